@@ -0,0 +1,97 @@
+"""
+Cold start check: how long `import app` takes and what it imports.
+
+    python -m bench.importtime                   # exit code 1 over the default budget
+    python -m bench.importtime --budget-ms 800   # a tighter budget
+
+Every run is a fresh interpreter. The wall time is the best of --runs plain
+imports, the per package breakdown comes from `python -X importtime`. The
+run also fails when a module that must stay lazy (Flask-Admin, flask_swagger,
+alembic, brotli, redis) is imported eagerly. tests/test_importtime.py runs
+the check with the defaults.
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+LAZY_MODULES = ('flask_admin', 'flask_swagger', 'flask_migrate', 'alembic', 'brotli', 'redis')
+# about twice a boot on one shared CPU, room for noise but not for a new eager import
+DEFAULT_BUDGET_MS = 1000
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+TIMED_IMPORT = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def _env(tmpdir):
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tmpdir, 'importtime.db'))
+    # gunicorn and uvicorn import the app outside of the flask command
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    return env
+
+
+def wall_time(env, runs):
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', TIMED_IMPORT], cwd=SRC, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return min(times)
+
+
+def import_log(env):
+    """[(module, self us, cumulative us, depth)] of one `import app`."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=SRC, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return modules
+
+
+def by_package(modules):
+    totals = {}
+    for name, self_us, _, _ in modules:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="packages to list")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help="fail when the best import time is above this (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='swapi-importtime-') as tmpdir:
+        env = _env(tmpdir)
+        best = wall_time(env, args.runs)
+        modules = import_log(env)
+
+    print("import app: %.0fms (best of %d)" % (best * 1000, args.runs))
+    print("%d modules, self time per top level package:" % len(modules))
+    for package, self_us in by_package(modules)[:args.top]:
+        print("  %-28s %8.1fms" % (package, self_us / 1000))
+
+    failures = []
+    eager = sorted({name.split('.')[0] for name, _, _, _ in modules} & set(LAZY_MODULES))
+    if eager:
+        failures.append("imported eagerly: %s" % ", ".join(eager))
+    if best * 1000 > args.budget_ms:
+        failures.append("import took %.0fms, budget is %.0fms" % (best * 1000, args.budget_ms))
+    for failure in failures:
+        print("FAIL " + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
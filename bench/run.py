@@ -0,0 +1,363 @@
+"""
+HTTP benchmark for every route of the API.
+
+    python -m bench.run                              # Flask test client, SQLite
+    python -m bench.run --mode gunicorn --workers 4  # real gunicorn process
+    python -m bench.run --mode gunicorn --gunicorn-config gunicorn.conf.py
+    python -m bench.run --db postgresql://localhost/bench
+    python -m bench.run --baseline bench/baseline.json
+
+Results are written as JSON (--output). With --baseline the run fails
+(exit code 1) when a route's p95 latency or throughput regresses more than
+the allowed ratio, or when it issues more queries per request than before.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+
+class Scenario:
+    def __init__(self, name, method, rule, path, body=None, after=None):
+        self.name = name
+        self.method = method
+        self.rule = rule      # route rule, used to read queries per request from /metrics
+        self.path = path      # path(i, ctx) -> url
+        self.body = body      # body(i, ctx) -> json payload
+        self.after = after    # after(i, ctx, response_json), e.g. to remember created ids
+
+
+def _fav(i, ctx):
+    # (bench user, entity id) pairs that are unique for every i
+    user_id = ctx['bench_user_base'] + i % ctx['bench_users']
+    return user_id, (i // ctx['bench_users']) % ctx['planets'] + 1
+
+
+def _remember(key, kind):
+    def after(i, ctx, data):
+        ctx.setdefault(key, {})[i] = data[kind]['id']
+    return after
+
+
+def _batch(i, ctx):
+    return [{"kind": kind, "id": (i * 5 + k) % ctx['planets'] + 1} for k in range(5) for kind in ('planet', 'people', 'vehicle')]
+
+
+def _page_ids(i, total):
+    # the ids of one 50 row catalog page
+    return ','.join(str((i * 50 + k) % total + 1) for k in range(50))
+
+
+def _bulk_ids(i, total):
+    # seeded rows from the top down, these scenarios run after every read
+    return ','.join(str(total - (i * 10 + k) % total) for k in range(10))
+
+
+SCENARIOS = [
+    Scenario('sitemap', 'GET', '/', lambda i, c: '/'),
+    Scenario('hello_user', 'GET', '/user', lambda i, c: '/user'),
+    Scenario('people_list', 'GET', '/people', lambda i, c: '/people'),
+    Scenario('people_page', 'GET', '/people', lambda i, c: '/people?limit=50&after=%d' % (i * 50 % c['people'])),
+    Scenario('people_item', 'GET', '/people/<int:people_id>', lambda i, c: '/people/%d' % (i % c['people'] + 1)),
+    Scenario('planets_list', 'GET', '/planets', lambda i, c: '/planets'),
+    Scenario('planets_page_fields', 'GET', '/planets', lambda i, c: '/planets?limit=100&fields=name,climate'),
+    Scenario('planets_filter_sort', 'GET', '/planets', lambda i, c: '/planets?climate=arid&sort=-population&limit=50'),
+    Scenario('planets_item', 'GET', '/planets/<int:planet_id>', lambda i, c: '/planets/%d' % (i % c['planets'] + 1)),
+    Scenario('vehicles_list', 'GET', '/vehicles', lambda i, c: '/vehicles'),
+    Scenario('vehicles_stream', 'GET', '/vehicles', lambda i, c: '/vehicles?stream=true'),
+    Scenario('vehicles_item', 'GET', '/vehicles/<int:vehicle_id>', lambda i, c: '/vehicles/%d' % (i % c['vehicles'] + 1)),
+    Scenario('users_list', 'GET', '/users', lambda i, c: '/users'),
+    Scenario('people_top', 'GET', '/people/top', lambda i, c: '/people/top?limit=10'),
+    Scenario('planets_top', 'GET', '/planets/top', lambda i, c: '/planets/top?limit=10'),
+    Scenario('vehicles_top', 'GET', '/vehicles/top', lambda i, c: '/vehicles/top?limit=10'),
+    Scenario('search_prefix', 'GET', '/search', lambda i, c: '/search?q=Planet+%d' % (i % c['planets'] + 1)),
+    Scenario('search_substring', 'GET', '/search', lambda i, c: '/search?q=son+%d' % (i % c['people'] + 1)),
+    Scenario('search_page', 'GET', '/search', lambda i, c: '/search?q=e&limit=50'),
+    Scenario('export_planets_ndjson', 'GET', '/export/<table>', lambda i, c: '/export/planets'),
+    Scenario('export_users_csv', 'GET', '/export/<table>', lambda i, c: '/export/users?format=csv&after_id=%d' % (i % c['users'])),
+    Scenario('user_favorites', 'GET', '/users/favorites', lambda i, c: '/users/favorites?user_id=%d' % (i % c['users'] + 1)),
+    Scenario('user_favorites_expand', 'GET', '/users/favorites', lambda i, c: '/users/favorites?expand=true&user_id=%d' % (i % c['users'] + 1)),
+    Scenario('favorites_contains', 'GET', '/users/<int:user_id>/favorites/contains',
+             lambda i, c: '/users/%d/favorites/contains?planet_ids=%s' % (i % c['users'] + 1, _page_ids(i, c['planets']))),
+    Scenario('fav_planet_add', 'POST', '/favorite/planet/<int:planet_id>', lambda i, c: '/favorite/planet/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('fav_people_add', 'POST', '/favorite/people/<int:people_id>', lambda i, c: '/favorite/people/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('fav_vehicle_add', 'POST', '/favorite/vehicle/<int:vehicle_id>', lambda i, c: '/favorite/vehicle/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('fav_planet_delete', 'DELETE', '/favorite/planet/<int:planet_id>', lambda i, c: '/favorite/planet/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('fav_people_delete', 'DELETE', '/favorite/people/<int:people_id>', lambda i, c: '/favorite/people/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('fav_vehicle_delete', 'DELETE', '/favorite/vehicle/<int:vehicle_id>', lambda i, c: '/favorite/vehicle/%d?user_id=%d' % _fav(i, c)[::-1]),
+    Scenario('favorites_batch_add', 'POST', '/users/<int:user_id>/favorites:batch',
+             lambda i, c: '/users/%d/favorites:batch' % _fav(i, c)[0], body=_batch),
+    Scenario('favorites_batch_delete', 'DELETE', '/users/<int:user_id>/favorites:batch',
+             lambda i, c: '/users/%d/favorites:batch' % _fav(i, c)[0], body=_batch),
+    Scenario('create_planet', 'POST', '/create/planet/', lambda i, c: '/create/planet/',
+             body=lambda i, c: {"name": "Bench planet %d" % i, "climate": "arid"}, after=_remember('planet_ids', 'planet')),
+    Scenario('create_people', 'POST', '/create/people/', lambda i, c: '/create/people/',
+             body=lambda i, c: {"name": "Bench person %d" % i}, after=_remember('people_ids', 'People')),
+    Scenario('create_vehicle', 'POST', '/create/vehicle/', lambda i, c: '/create/vehicle/',
+             body=lambda i, c: {"name": "Bench vehicle %d" % i}, after=_remember('vehicle_ids', 'Vehicle')),
+    Scenario('create_planets_bulk', 'POST', '/create/planet/', lambda i, c: '/create/planet/',
+             body=lambda i, c: [{"name": "Bench bulk planet %d-%d" % (i, k)} for k in range(50)]),
+    Scenario('update_planet', 'PUT', '/update/planet/<int:planet_id>', lambda i, c: '/update/planet/%d' % c['planet_ids'][i],
+             body=lambda i, c: {"population": i}),
+    Scenario('update_people', 'PUT', '/update/people/<int:people_id>', lambda i, c: '/update/people/%d' % c['people_ids'][i],
+             body=lambda i, c: {"height": i}),
+    Scenario('update_vehicle', 'PUT', '/update/vehicle/<int:vehicle_id>', lambda i, c: '/update/vehicle/%d' % c['vehicle_ids'][i],
+             body=lambda i, c: {"crew": i}),
+    Scenario('patch_planet', 'PATCH', '/update/planet/<int:planet_id>', lambda i, c: '/update/planet/%d' % c['planet_ids'][i],
+             body=lambda i, c: {"diameter": i}),
+    Scenario('patch_people', 'PATCH', '/update/people/<int:people_id>', lambda i, c: '/update/people/%d' % c['people_ids'][i],
+             body=lambda i, c: {"gender": "n/a"}),
+    Scenario('patch_vehicle', 'PATCH', '/update/vehicle/<int:vehicle_id>', lambda i, c: '/update/vehicle/%d' % c['vehicle_ids'][i],
+             body=lambda i, c: {"length": i}),
+    Scenario('delete_planet', 'DELETE', '/delete/planet/<int:planet_id>', lambda i, c: '/delete/planet/%d' % c['planet_ids'][i]),
+    Scenario('delete_people', 'DELETE', '/delete/people/<int:people_id>', lambda i, c: '/delete/people/%d' % c['people_ids'][i]),
+    Scenario('delete_vehicle', 'DELETE', '/delete/vehicle/<int:vehicle_id>', lambda i, c: '/delete/vehicle/%d' % c['vehicle_ids'][i]),
+    Scenario('delete_planets_bulk', 'DELETE', '/planets', lambda i, c: '/planets?ids=' + _bulk_ids(i, c['planets'])),
+    Scenario('delete_people_bulk', 'DELETE', '/people', lambda i, c: '/people?ids=' + _bulk_ids(i, c['people'])),
+    Scenario('delete_vehicles_bulk', 'DELETE', '/vehicles', lambda i, c: '/vehicles?ids=' + _bulk_ids(i, c['vehicles'])),
+    Scenario('internal_pool', 'GET', '/internal/pool', lambda i, c: '/internal/pool'),
+]
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HTTPTransport:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, body=None):
+        # gunicorn sync workers close the connection after every response
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+
+METRIC_LINE = re.compile(r'^db_statements_per_request_(sum|count)\{method="([A-Z]+)",endpoint="([^"]*)"\} ([0-9.e+]+)$')
+
+
+def scrape_queries(transport):
+    status, body = transport.request('GET', '/metrics')
+    totals = {}
+    if status != 200:
+        return totals
+    for line in body.decode().splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, method, endpoint, value = match.groups()
+            totals.setdefault((method, endpoint), {})[kind] = float(value)
+    return totals
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_scenario(transport, scenario, ctx, requests, concurrency):
+    def one(i):
+        body = scenario.body(i, ctx) if scenario.body else None
+        start = time.perf_counter()
+        status, data = transport.request(scenario.method, scenario.path(i, ctx), body)
+        elapsed = time.perf_counter() - start
+        if scenario.after and status < 300:
+            scenario.after(i, ctx, json.loads(data))
+        return elapsed, status
+
+    before = scrape_queries(transport).get((scenario.method, scenario.rule), {})
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, range(requests)))
+    else:
+        results = [one(i) for i in range(requests)]
+    wall = time.perf_counter() - start
+    after = scrape_queries(transport).get((scenario.method, scenario.rule), {})
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    count = after.get('count', 0) - before.get('count', 0)
+    queries = (after.get('sum', 0) - before.get('sum', 0)) / count if count else None
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "method": scenario.method,
+        "rule": scenario.rule,
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "rps": round(requests / wall, 1) if wall else None,
+        "queries_per_request": round(queries, 2) if queries is not None else None,
+        "statuses": statuses,
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(env, workers, config=None):
+    port = _free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC,
+           '-b', '127.0.0.1:%d' % port, '--log-level', 'warning']
+    if config:
+        cmd += ['-c', config]
+    if workers or not config:
+        cmd += ['-w', str(workers or 2)]
+    process = subprocess.Popen(cmd, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, port
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("gunicorn exited with code %s" % process.returncode)
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start on port %d" % port)
+
+
+def compare(results, baseline, max_latency_regression, max_throughput_regression):
+    failures = []
+    for name, base in baseline.get('routes', {}).items():
+        current = results['routes'].get(name)
+        if current is None:
+            continue
+        if base['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + max_latency_regression):
+            failures.append("%s: p95 %.2fms > baseline %.2fms" % (name, current['p95_ms'], base['p95_ms']))
+        if base['rps'] and current['rps'] < base['rps'] * (1 - max_throughput_regression):
+            failures.append("%s: %.1f req/s < baseline %.1f req/s" % (name, current['rps'], base['rps']))
+        if base['queries_per_request'] is not None and current['queries_per_request'] is not None \
+                and current['queries_per_request'] > base['queries_per_request']:
+            failures.append("%s: %.2f queries/request > baseline %.2f" % (
+                name, current['queries_per_request'], base['queries_per_request']))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--db', help="database url, defaults to a temporary SQLite file")
+    parser.add_argument('--rows', type=int, default=1000, help="people, planets and vehicles rows")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--favorites-per-user', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--workers', type=int, help="gunicorn workers (default 2, or the config's)")
+    parser.add_argument('--gunicorn-config', help="gunicorn config file for --mode gunicorn")
+    parser.add_argument('--cache', action='store_true', help="keep the response cache enabled")
+    parser.add_argument('--only', help="comma separated scenario names")
+    parser.add_argument('--output', default=os.path.join(ROOT, 'bench', 'results', 'latest.json'))
+    parser.add_argument('--baseline', help="baseline results to compare against")
+    parser.add_argument('--max-latency-regression', type=float, default=0.5)
+    parser.add_argument('--max-throughput-regression', type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix='swapi-bench-')
+    db_url = args.db or 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+    os.environ['DATABASE_URL'] = db_url
+    os.environ['METRICS_MULTIPROC_DIR'] = os.path.join(tmpdir, 'metrics')
+    os.environ['CACHE_ENABLED'] = '1' if args.cache else '0'
+    os.environ.pop('INTERNAL_API_TOKEN', None)
+    sys.path.insert(0, SRC)
+    from app import app
+    from bench.seed import seed
+
+    bench_users = max(1, args.requests // args.rows + 1)
+    counts = seed(app, people=args.rows, planets=args.rows, vehicles=args.rows, users=args.users,
+                  favorites_per_user=args.favorites_per_user, bench_users=bench_users)
+    ctx = dict(counts, bench_user_base=args.users + 1)
+
+    process = None
+    if args.mode == 'gunicorn':
+        process, port = start_gunicorn(dict(os.environ), args.workers, args.gunicorn_config)
+        transport = HTTPTransport('127.0.0.1', port)
+    else:
+        transport = TestClientTransport(app)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {
+        "meta": {
+            "mode": args.mode,
+            "database": db_url.split(':', 1)[0],
+            "rows": args.rows,
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers if args.mode == 'gunicorn' else None,
+            "gunicorn_profile": os.getenv('GUNICORN_PROFILE', 'cpu') if args.gunicorn_config else None,
+            "cache": args.cache,
+            "python": platform.python_version(),
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        "routes": {},
+    }
+    try:
+        for scenario in SCENARIOS:
+            if only and scenario.name not in only:
+                continue
+            result = run_scenario(transport, scenario, ctx, args.requests, args.concurrency)
+            results['routes'][scenario.name] = result
+            print("%-24s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %8.1f req/s  %s q/req  %s" % (
+                scenario.name, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['rps'],
+                result['queries_per_request'], result['statuses']))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("results written to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        keys = ('mode', 'database', 'rows', 'requests', 'concurrency', 'cache')
+        if any(baseline['meta'].get(key) != results['meta'][key] for key in keys):
+            print("warning: baseline was recorded with different settings: %s" % baseline['meta'])
+        failures = compare(results, baseline, args.max_latency_regression, args.max_throughput_regression)
+        for failure in failures:
+            print("REGRESSION " + failure)
+        if failures:
+            return 1
+        print("no regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Seeds a fresh database with deterministic benchmark data.
+
+Ids are assigned explicitly (1..N) so the scenarios in bench/run.py know
+which rows exist without asking the API.
+"""
+from sqlalchemy import insert, text
+
+CHUNK_SIZE = 5000
+CLIMATES = ['arid', 'temperate', 'frozen', 'murky', 'tropical']
+GENDERS = ['male', 'female', 'n/a']
+EYE_COLORS = ['blue', 'brown', 'yellow', 'red', 'black']
+KINDS = ['planet', 'people', 'vehicle']
+
+
+def _insert(db, model, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+
+
+def seed(app, people=1000, planets=1000, vehicles=1000, users=100, favorites_per_user=10, bench_users=10):
+    """Drops and recreates every table, then loads the rows.
+
+    The last ``bench_users`` users get no favorites, the favorite scenarios
+    write on them so they never collide with seeded rows.
+    """
+    from models import db, User, People, Planets, Vehicles, Favorites, reconcile_favorite_counts
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        total_users = users + bench_users
+        _insert(db, User, ({
+            "id": i, "email": "user%d@bench.local" % i, "password": "bench", "is_active": True,
+            "first_name": "First%d" % i, "last_name": "Last%d" % i, "username": "user%d" % i,
+        } for i in range(1, total_users + 1)))
+        _insert(db, People, ({
+            "id": i, "name": "Person %d" % i, "eye_color": EYE_COLORS[i % len(EYE_COLORS)],
+            "height": 100 + i % 120, "skin_color": "fair", "gender": GENDERS[i % len(GENDERS)],
+        } for i in range(1, people + 1)))
+        _insert(db, Planets, ({
+            "id": i, "name": "Planet %d" % i, "gravity": i % 3 + 1, "population": i * 1000,
+            "climate": CLIMATES[i % len(CLIMATES)], "diameter": 5000 + i % 10000,
+        } for i in range(1, planets + 1)))
+        _insert(db, Vehicles, ({
+            "id": i, "name": "Vehicle %d" % i, "model": "Model %d" % (i % 50), "passengers": i % 40,
+            "cost_in_credits": 1000 + i * 10, "crew": i % 5 + 1, "length": i % 100 + 1,
+        } for i in range(1, vehicles + 1)))
+
+        def favorites():
+            for user_id in range(1, users + 1):
+                seen = set()
+                for k in range(favorites_per_user):
+                    kind, total = KINDS[k % 3], (planets, people, vehicles)[k % 3]
+                    row = {"user_id": user_id, "entity_type": kind, "entity_id": (user_id * 7 + k) % total + 1}
+                    key = (kind, row["entity_id"])
+                    if key not in seen:
+                        seen.add(key)
+                        yield row
+        _insert(db, Favorites, favorites())
+        reconcile_favorite_counts()
+
+        if db.engine.dialect.name == 'postgresql':
+            # explicit ids do not advance the serial sequences
+            for table in ('user', 'people', 'planets', 'vehicles'):
+                db.session.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('\"%s\"', 'id'), (SELECT MAX(id) FROM \"%s\"))" % (table, table)))
+        db.session.commit()
+
+    return {"people": people, "planets": planets, "vehicles": vehicles,
+            "users": users, "bench_users": bench_users, "favorites_per_user": favorites_per_user}
@@ -0,0 +1,170 @@
+"""
+gunicorn settings, read by `gunicorn wsgi --chdir ./src/ -c gunicorn.conf.py`.
+
+GUNICORN_PROFILE declares what the handlers spend their time on and picks
+the worker model, the numbers behind each choice are in bench/README.md:
+
+  * cpu (default): handlers are busy in Python (serialization,
+    compression). One sync worker per CPU plus one, a single worker on
+    one CPU where a second only adds switching. Threads would only
+    contend for the GIL. The fastest profile in every run so far.
+  * db: handlers wait on the database. gthread workers, so a worker keeps
+    serving while its other threads wait on SQL. Measure it against the
+    real database (bench/README.md) before switching to it.
+  * io: many slow, mostly idle requests. gevent workers when gevent is
+    installed (with psycogreen for Postgres), gthread otherwise.
+
+Every setting can be overridden: WEB_CONCURRENCY (workers),
+GUNICORN_WORKER_CLASS, GUNICORN_THREADS, GUNICORN_WORKER_CONNECTIONS,
+GUNICORN_MAX_WORKERS, GUNICORN_WORKER_MEMORY_MB, GUNICORN_MEMORY_MB, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT,
+GUNICORN_KEEPALIVE, GUNICORN_MAX_REQUESTS, GUNICORN_MAX_REQUESTS_JITTER,
+GUNICORN_PRELOAD and GUNICORN_LOG_LEVEL. Command line flags win over all
+of them.
+
+Each worker has its own connection pool. Unless DB_POOL_SIZE and
+DB_MAX_OVERFLOW are set, the pool is sized to the worker's threads (the
+most connections it can use at once), so the server opens at most
+workers x threads connections per database. The worst case is logged at
+startup. Keep it under the database's max_connections, which is small on
+free Postgres plans.
+
+Workers are also capped by memory: one per GUNICORN_WORKER_MEMORY_MB
+(128) of the container's memory limit, so a 512MB instance runs at most 4.
+The limit is read from the cgroup, GUNICORN_MEMORY_MB overrides it.
+"""
+import os
+import sys
+import glob
+import importlib.util
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _cpu_count():
+    # the CPUs this process may run on, a container often gets fewer than the host has
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _memory_mb():
+    # the container's limit (cgroup v2, then v1), else the machine's memory
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # "max" or a huge number when there is no limit
+        if limit.isdigit() and int(limit) < 1 << 50:
+            return int(limit) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+PROFILE = os.getenv('GUNICORN_PROFILE', 'cpu')
+if PROFILE not in ('db', 'cpu', 'io'):
+    raise RuntimeError("GUNICORN_PROFILE must be db, cpu or io, not %r" % PROFILE)
+CPUS = _cpu_count()
+MEMORY_MB = _env_int('GUNICORN_MEMORY_MB', None) or _memory_mb()
+HAS_GEVENT = importlib.util.find_spec('gevent') is not None
+
+if PROFILE == 'db':
+    default_class, default_workers, default_threads = 'gthread', 2 * CPUS + 1, 4
+elif PROFILE == 'io' and HAS_GEVENT:
+    default_class, default_workers, default_threads = 'gevent', CPUS, 1
+elif PROFILE == 'io':
+    default_class, default_workers, default_threads = 'gthread', CPUS, 8
+else:
+    # measured on one CPU, a second worker only pays for switching (bench/README.md)
+    default_class, default_workers, default_threads = 'sync', CPUS + 1 if CPUS > 1 else 1, 1
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', default_class)
+# every worker holds its own connection pool, the cap keeps big hosts under max_connections
+max_workers = _env_int('GUNICORN_MAX_WORKERS', 8)
+# and its own copy of the app once it writes to the preloaded pages, too many get OOM-killed
+if MEMORY_MB:
+    max_workers = min(max_workers, max(1, MEMORY_MB // _env_int('GUNICORN_WORKER_MEMORY_MB', 128)))
+workers = _env_int('WEB_CONCURRENCY', min(default_workers, max_workers))
+# more threads than DB_POOL_SIZE + DB_MAX_OVERFLOW would only queue on the pool
+threads = _env_int('GUNICORN_THREADS', default_threads)
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 100)
+
+# read by pooling.engine_options_from_env when the app is imported. A thread
+# holds one connection per database at a time, more would only add
+# connections every worker may open. gevent greenlets queue on the pool.
+if worker_class != 'gevent':
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+    os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+
+# import the app once in the master, the workers share its modules copy-on-write
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') not in ('0', 'false')
+
+# above DB_STATEMENT_TIMEOUT, so a slow query fails with an error before its worker is killed
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+# longer than the 2s default, the platform's proxy reuses connections to the workers
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# restart workers now and then against slow leaks, the jitter keeps them from restarting together
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# the heartbeat file, on a RAM disk when there is one
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+
+
+def on_starting(server):
+    # server.cfg includes the command line flags
+    server.log.info("profile %s: %d %s workers, %d threads, %d CPUs, %sMB memory",
+                    PROFILE, server.cfg.workers, server.cfg.worker_class_str, server.cfg.threads, CPUS,
+                    MEMORY_MB or '?')
+    if PROFILE == 'io' and not HAS_GEVENT:
+        server.log.warning("gevent is not installed, the io profile falls back to gthread workers")
+    pool = _env_int('DB_POOL_SIZE', 5) + _env_int('DB_MAX_OVERFLOW', 10)
+    server.log.info("up to %d database connections (%d workers x %d pooled), per database",
+                    server.cfg.workers * pool, server.cfg.workers, pool)
+    if server.cfg.worker_class_str != 'gevent' and server.cfg.threads > pool:
+        server.log.warning("%d threads share %d pooled connections, set DB_POOL_SIZE", server.cfg.threads, pool)
+    if server.cfg.workers > 1 and not os.getenv('CACHE_REDIS_URL'):
+        # each worker keeps its own table and favorites versions, a write on one never reaches the others
+        server.log.warning("%d workers without CACHE_REDIS_URL: cached responses and favorites can be "
+                           "stale for up to CACHE_TTL / FAVORITES_INDEX_TTL seconds after a write", server.cfg.workers)
+    # counters of the previous run's workers would otherwise be summed into /metrics
+    multiproc_dir = os.getenv('METRICS_MULTIPROC_DIR')
+    if multiproc_dir:
+        for path in glob.glob(os.path.join(multiproc_dir, '*.json')):
+            os.remove(path)
+
+
+def post_fork(server, worker):
+    if server.cfg.worker_class_str == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            pass
+
+    # with preload_app the engines were created in the master, a worker must
+    # never reuse the master's pooled connections (one socket, two processes)
+    app_module = sys.modules.get('app')
+    if app_module is None:
+        return
+    from models import db
+    from replicas import replicas
+    with app_module.app.app_context():
+        # close=False: leave the sockets alone, they still belong to the master
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    for engine in replicas.engines:
+        engine.dispose(close=False)
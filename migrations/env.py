@@ -1,5 +1,6 @@
 from __future__ import with_statement
 
+import re
 import logging
 from logging.config import fileConfig
 
@@ -38,6 +39,15 @@ def get_metadata():
     return target_db.metadata
 
 
+# the name search indexes and FTS5 tables are created with raw SQL (see
+# src/search.py), keep autogenerate from proposing to drop them
+SEARCH_OBJECTS = re.compile(r'^((people|planets|vehicles)_search|ix_\w+_name_(trgm|lower|nocase)$)')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and compare_to is None and SEARCH_OBJECTS.match(name or ''))
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -80,10 +90,15 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # batch migrations recreate tables, with foreign keys on dropping
+            # a referenced table would cascade into its children
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,39 @@
+"""favorites composite unique indexes
+
+Revision ID: 3c9a1f0d7e21
+Revises: daf63bfca9a7
+Create Date: 2026-10-18 10:02:11.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9a1f0d7e21'
+down_revision = 'daf63bfca9a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # drop duplicated favorites left by the old check-then-insert handlers,
+    # otherwise the unique indexes below can not be created
+    for column in ('planet_id', 'people_id', 'vehicle_id'):
+        op.execute(
+            "DELETE FROM favorites WHERE {col} IS NOT NULL AND id NOT IN ("
+            "SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM favorites "
+            "WHERE {col} IS NOT NULL GROUP BY user_id, {col}) AS keep)".format(col=column)
+        )
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_index('ix_favorites_user_planet', ['user_id', 'planet_id'], unique=True)
+        batch_op.create_index('ix_favorites_user_people', ['user_id', 'people_id'], unique=True)
+        batch_op.create_index('ix_favorites_user_vehicle', ['user_id', 'vehicle_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorites_user_vehicle')
+        batch_op.drop_index('ix_favorites_user_people')
+        batch_op.drop_index('ix_favorites_user_planet')
@@ -0,0 +1,28 @@
+"""catalog row versions for optimistic concurrency
+
+Revision ID: 5d7f3b9e1a42
+Revises: 8b2e4d6a9c13
+Create Date: 2026-10-18 13:41:05.662180
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7f3b9e1a42'
+down_revision = '8b2e4d6a9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('people', 'planets', 'vehicles'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('people', 'planets', 'vehicles'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
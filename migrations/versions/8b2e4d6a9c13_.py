@@ -0,0 +1,39 @@
+"""catalog filter and sort indexes
+
+Revision ID: 8b2e4d6a9c13
+Revises: 3c9a1f0d7e21
+Create Date: 2026-10-18 11:24:47.093518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6a9c13'
+down_revision = '3c9a1f0d7e21'
+branch_labels = None
+depends_on = None
+
+
+# (column, id) so equality filters can still walk the id order used by
+# keyset pagination, and ?sort=<column> is an index scan
+INDEXES = {
+    'people': ['gender', 'eye_color', 'height'],
+    'planets': ['climate', 'population', 'diameter'],
+    'vehicles': ['model', 'passengers', 'cost_in_credits'],
+}
+
+
+def upgrade():
+    for table, columns in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in columns:
+                batch_op.create_index('ix_%s_%s' % (table, column), [column, 'id'], unique=False)
+
+
+def downgrade():
+    for table, columns in INDEXES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for column in reversed(columns):
+                batch_op.drop_index('ix_%s_%s' % (table, column))
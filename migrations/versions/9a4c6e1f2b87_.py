@@ -0,0 +1,59 @@
+"""name search indexes: pg_trgm on Postgres, FTS5 trigram tables on SQLite
+
+Revision ID: 9a4c6e1f2b87
+Revises: e7b3a9c5f160
+Create Date: 2026-10-18 16:35:50.913274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6e1f2b87'
+down_revision = 'e7b3a9c5f160'
+branch_labels = None
+depends_on = None
+
+TABLES = ('people', 'planets', 'vehicles')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table in TABLES:
+            op.execute("CREATE INDEX ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)".format(table=table))
+            op.execute('CREATE INDEX ix_{table}_name_lower ON {table} (lower(name) COLLATE "C")'.format(table=table))
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            op.execute("CREATE INDEX ix_{table}_name_nocase ON {table} (name COLLATE NOCASE)".format(table=table))
+            op.execute(
+                "CREATE VIRTUAL TABLE {table}_search USING fts5("
+                "name, content='{table}', content_rowid='id', tokenize='trigram')".format(table=table))
+            op.execute(
+                "CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN "
+                "INSERT INTO {table}_search(rowid, name) VALUES (new.id, new.name); END".format(table=table))
+            op.execute(
+                "CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN "
+                "INSERT INTO {table}_search({table}_search, rowid, name) VALUES ('delete', old.id, old.name); END".format(table=table))
+            op.execute(
+                "CREATE TRIGGER {table}_search_update AFTER UPDATE OF name ON {table} BEGIN "
+                "INSERT INTO {table}_search({table}_search, rowid, name) VALUES ('delete', old.id, old.name); "
+                "INSERT INTO {table}_search(rowid, name) VALUES (new.id, new.name); END".format(table=table))
+            # index the rows that already exist
+            op.execute("INSERT INTO {table}_search({table}_search) VALUES ('rebuild')".format(table=table))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.execute("DROP INDEX ix_{table}_name_lower".format(table=table))
+            op.execute("DROP INDEX ix_{table}_name_trgm".format(table=table))
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute("DROP TRIGGER {table}_search_{trigger}".format(table=table, trigger=trigger))
+            op.execute("DROP TABLE {table}_search".format(table=table))
+            op.execute("DROP INDEX ix_{table}_name_nocase".format(table=table))
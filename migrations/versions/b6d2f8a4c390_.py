@@ -0,0 +1,211 @@
+"""favorites as (user_id, entity_type, entity_id)
+
+Revision ID: b6d2f8a4c390
+Revises: 9a4c6e1f2b87
+Create Date: 2026-10-18 18:12:40.552917
+
+The new layout is built next to the old table as favorites_v2 and filled in
+id ranges, every batch in its own short transaction, while the app keeps
+writing to favorites. Triggers installed before the backfill log the id of
+every favorite inserted, updated or deleted meanwhile in favorites_changes,
+and those ids are copied again in batches, still without locking. Only the
+final swap locks favorites against writes: it applies the few changes
+logged since the last batch and renames the table. An interrupted upgrade
+continues where it stopped when it is run again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f8a4c390'
+down_revision = '9a4c6e1f2b87'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+KINDS = {'planet': 'planets', 'people': 'people', 'vehicle': 'vehicles'}
+
+COPY_ROWS = """
+    INSERT INTO favorites_v2 (id, user_id, entity_type, entity_id)
+    SELECT id, user_id,
+           CASE WHEN planet_id IS NOT NULL THEN 'planet'
+                WHEN people_id IS NOT NULL THEN 'people' ELSE 'vehicle' END,
+           COALESCE(planet_id, people_id, vehicle_id)
+    FROM favorites
+    WHERE {where} AND user_id IS NOT NULL
+      AND COALESCE(planet_id, people_id, vehicle_id) IS NOT NULL
+    ON CONFLICT DO NOTHING
+"""
+
+# favorites_changes gets the id of every row written to favorites after the
+# triggers exist, the ids are copied again until none are left
+SQLITE_LOG_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS favorites_log_insert AFTER INSERT ON favorites BEGIN "
+    "INSERT INTO favorites_changes (favorite_id) VALUES (new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS favorites_log_update AFTER UPDATE ON favorites BEGIN "
+    "INSERT INTO favorites_changes (favorite_id) VALUES (old.id), (new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS favorites_log_delete AFTER DELETE ON favorites BEGIN "
+    "INSERT INTO favorites_changes (favorite_id) VALUES (old.id); END",
+]
+POSTGRES_LOG_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION favorites_log_change() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "IF TG_OP <> 'INSERT' THEN INSERT INTO favorites_changes (favorite_id) VALUES (OLD.id); END IF; "
+    "IF TG_OP <> 'DELETE' THEN INSERT INTO favorites_changes (favorite_id) VALUES (NEW.id); END IF; "
+    "RETURN NULL; END $$")
+POSTGRES_LOG_TRIGGER = (
+    "CREATE TRIGGER favorites_log_change AFTER INSERT OR UPDATE OR DELETE ON favorites "
+    "FOR EACH ROW EXECUTE PROCEDURE favorites_log_change()")
+
+SQLITE_TRIGGER = (
+    "CREATE TRIGGER {table}_favorites_delete AFTER DELETE ON {table} BEGIN "
+    "DELETE FROM favorites WHERE entity_type = '{kind}' AND entity_id = old.id; END")
+POSTGRES_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION favorites_cascade() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "DELETE FROM favorites f USING deleted d WHERE f.entity_type = TG_ARGV[0] AND f.entity_id = d.id; "
+    "RETURN NULL; END $$")
+POSTGRES_TRIGGER = (
+    "CREATE TRIGGER {table}_favorites_delete AFTER DELETE ON {table} REFERENCING OLD TABLE AS deleted "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE favorites_cascade('{kind}')")
+
+
+def _create_v2_table(dialect):
+    op.create_table('favorites_v2',
+    # Postgres: the id keeps drawing from favorites_id_seq, attached at the swap
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('entity_type', sa.String(length=16), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.CheckConstraint("entity_type IN ('planet', 'people', 'vehicle')", name='ck_favorites_entity_type'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='favorites_user_id_fkey'),
+    # renamed with the table on Postgres, where the name has to be unique in the schema
+    sa.PrimaryKeyConstraint('id', name='favorites_v2_pkey' if dialect == 'postgresql' else None)
+    )
+    # before the backfill: ON CONFLICT needs the unique index
+    op.create_index('ix_favorites_user_entity', 'favorites_v2', ['user_id', 'entity_type', 'entity_id'],
+                    unique=True, postgresql_include=['id'])
+    op.create_index('ix_favorites_entity', 'favorites_v2', ['entity_type', 'entity_id'], unique=False)
+
+
+def _log_changes(dialect):
+    op.create_table('favorites_changes',
+    sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('favorite_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    if dialect == 'postgresql':
+        op.execute(POSTGRES_LOG_FUNCTION)
+        op.execute(POSTGRES_LOG_TRIGGER)
+    else:
+        for statement in SQLITE_LOG_TRIGGERS:
+            op.execute(statement)
+
+
+def _apply_changes(bind):
+    """Copies the favorites of the oldest logged changes again, returns how
+    many changes were applied.
+
+    Only committed changes are visible, a change committed later than a newer
+    one is picked up by a later batch. A batch interrupted halfway leaves its
+    changes in the log, copying them again gives the same rows.
+    """
+    changes = bind.execute(sa.text("SELECT seq, favorite_id FROM favorites_changes ORDER BY seq LIMIT :limit"),
+                           {"limit": BATCH_SIZE}).all()
+    if not changes:
+        return 0
+    ids = sorted({favorite_id for _, favorite_id in changes})
+    # deleted first: a favorite removed and added again must not collide with its old row
+    bind.execute(sa.text("DELETE FROM favorites_v2 WHERE id IN :ids").bindparams(sa.bindparam('ids', expanding=True)),
+                 {"ids": ids})
+    bind.execute(sa.text(COPY_ROWS.format(where='id IN :ids')).bindparams(sa.bindparam('ids', expanding=True)),
+                 {"ids": ids})
+    bind.execute(sa.text("DELETE FROM favorites_changes WHERE seq IN :seqs").bindparams(
+        sa.bindparam('seqs', expanding=True)), {"seqs": [seq for seq, _ in changes]})
+    return len(changes)
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    inspector = sa.inspect(bind)
+    if not inspector.has_table('favorites_v2'):
+        _create_v2_table(dialect)
+        _log_changes(dialect)
+    elif not inspector.has_table('favorites_changes'):
+        # left by an upgrade that did not log changes yet, its rows may be stale
+        op.execute("DELETE FROM favorites_v2")
+        _log_changes(dialect)
+
+    with op.get_context().autocommit_block():
+        # from here on every change to favorites is logged, the rows copied below can only be stale if logged
+        low = bind.execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM favorites_v2")).scalar()
+        high = bind.execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM favorites")).scalar()
+        copy_range = sa.text(COPY_ROWS.format(where='id > :low AND id <= :high'))
+        while low < high:
+            bind.execute(copy_range, {"low": low, "high": low + BATCH_SIZE})
+            low += BATCH_SIZE
+        # until a batch comes back short, what is left for the swap is less than one batch
+        while _apply_changes(bind) == BATCH_SIZE:
+            pass
+
+    # the swap, writes to favorites wait for it, reads go on until the DROP
+    if dialect == 'postgresql':
+        op.execute("LOCK TABLE favorites IN SHARE ROW EXCLUSIVE MODE")
+    # the writes committed since the last batch, nothing else can write now
+    while _apply_changes(bind):
+        pass
+    if dialect == 'postgresql':
+        op.execute("ALTER SEQUENCE favorites_id_seq OWNED BY favorites_v2.id")
+        op.execute("ALTER TABLE favorites_v2 ALTER COLUMN id SET DEFAULT nextval('favorites_id_seq')")
+    # the log triggers go with the table
+    op.drop_table('favorites')
+    op.drop_table('favorites_changes')
+    op.rename_table('favorites_v2', 'favorites')
+    if dialect == 'postgresql':
+        op.execute("DROP FUNCTION favorites_log_change()")
+        op.execute("ALTER INDEX favorites_v2_pkey RENAME TO favorites_pkey")
+        op.execute(POSTGRES_FUNCTION)
+        for kind, table in KINDS.items():
+            op.execute(POSTGRES_TRIGGER.format(table=table, kind=kind))
+    elif dialect == 'sqlite':
+        for kind, table in KINDS.items():
+            op.execute(SQLITE_TRIGGER.format(table=table, kind=kind))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in KINDS.values():
+        op.execute("DROP TRIGGER {table}_favorites_delete{on}".format(
+            table=table, on=' ON %s' % table if dialect == 'postgresql' else ''))
+    if dialect == 'postgresql':
+        op.execute("DROP FUNCTION favorites_cascade()")
+
+    op.create_table('favorites_v1',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('planet_id', sa.Integer(), nullable=True),
+    sa.Column('people_id', sa.Integer(), nullable=True),
+    sa.Column('vehicle_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='favorites_user_id_fkey'),
+    sa.ForeignKeyConstraint(['planet_id'], ['planets.id'], name='favorites_planet_id_fkey', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['people_id'], ['people.id'], name='favorites_people_id_fkey', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['vehicle_id'], ['vehicles.id'], name='favorites_vehicle_id_fkey', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', name='favorites_v1_pkey' if dialect == 'postgresql' else None)
+    )
+    op.execute(
+        "INSERT INTO favorites_v1 (id, user_id, planet_id, people_id, vehicle_id) "
+        "SELECT id, user_id, "
+        "CASE WHEN entity_type = 'planet' THEN entity_id END, "
+        "CASE WHEN entity_type = 'people' THEN entity_id END, "
+        "CASE WHEN entity_type = 'vehicle' THEN entity_id END "
+        "FROM favorites")
+    if dialect == 'postgresql':
+        op.execute("ALTER SEQUENCE favorites_id_seq OWNED BY favorites_v1.id")
+        op.execute("ALTER TABLE favorites_v1 ALTER COLUMN id SET DEFAULT nextval('favorites_id_seq')")
+    op.drop_table('favorites')
+    op.rename_table('favorites_v1', 'favorites')
+    if dialect == 'postgresql':
+        op.execute("ALTER INDEX favorites_v1_pkey RENAME TO favorites_pkey")
+    for column in ('planet_id', 'people_id', 'vehicle_id'):
+        op.create_index('ix_favorites_user_%s' % column[:-3], 'favorites', ['user_id', column], unique=True)
+        op.create_index('ix_favorites_%s' % column, 'favorites', [column], unique=False)
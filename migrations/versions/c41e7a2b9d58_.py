@@ -0,0 +1,37 @@
+"""favorites cascade with their planet, person or vehicle
+
+Revision ID: c41e7a2b9d58
+Revises: 5d7f3b9e1a42
+Create Date: 2026-10-18 15:02:37.418906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7a2b9d58'
+down_revision = '5d7f3b9e1a42'
+branch_labels = None
+depends_on = None
+
+# the original constraints were created unnamed, this matches the names
+# Postgres gave them and lets batch mode find them on SQLite
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+REFERENCES = {'planet_id': 'planets', 'people_id': 'people', 'vehicle_id': 'vehicles'}
+
+
+def upgrade():
+    with op.batch_alter_table('favorites', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        for column, table in REFERENCES.items():
+            batch_op.drop_constraint('favorites_%s_fkey' % column, type_='foreignkey')
+            batch_op.create_foreign_key('favorites_%s_fkey' % column, table, [column], ['id'], ondelete='CASCADE')
+            batch_op.create_index('ix_favorites_%s' % column, [column], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        for column, table in REFERENCES.items():
+            batch_op.drop_index('ix_favorites_%s' % column)
+            batch_op.drop_constraint('favorites_%s_fkey' % column, type_='foreignkey')
+            batch_op.create_foreign_key('favorites_%s_fkey' % column, table, [column], ['id'])
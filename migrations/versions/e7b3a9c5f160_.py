@@ -0,0 +1,37 @@
+"""favorites_count counters on people, planets and vehicles
+
+Revision ID: e7b3a9c5f160
+Revises: c41e7a2b9d58
+Create Date: 2026-10-18 15:48:12.207341
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3a9c5f160'
+down_revision = 'c41e7a2b9d58'
+branch_labels = None
+depends_on = None
+
+COLUMNS = {'people': 'people_id', 'planets': 'planet_id', 'vehicles': 'vehicle_id'}
+
+
+def upgrade():
+    for table, column in COLUMNS.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorites_count', sa.Integer(), server_default='0', nullable=False))
+            batch_op.create_index('ix_%s_favorites_count' % table, ['favorites_count', 'id'], unique=False)
+        # start from the real counts, afterwards the API keeps them up to date
+        op.execute(
+            "UPDATE {table} SET favorites_count = "
+            "(SELECT COUNT(*) FROM favorites WHERE favorites.{column} = {table}.id)".format(table=table, column=column)
+        )
+
+
+def downgrade():
+    for table in COLUMNS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index('ix_%s_favorites_count' % table)
+            batch_op.drop_column('favorites_count')
@@ -1,20 +1,69 @@
 import os
-from flask_admin import Admin
+import threading
+from flask import Flask
 from models import db, User, People, Planets, Vehicles, Favorites
-from flask_admin.contrib.sqla import ModelView
 
 def setup_admin(app):
+    # imported here, Flask-Admin is one of the slowest imports of the app
+    from flask_admin import Admin
+    from admin_views import UserView, CatalogView, FavoritesView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(People, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(Vehicles, db.session))
-    admin.add_view(ModelView(Favorites, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CatalogView(People, db.session))
+    admin.add_view(CatalogView(Planets, db.session))
+    admin.add_view(CatalogView(Vehicles, db.session))
+    admin.add_view(FavoritesView(Favorites, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ScalableModelView(YourModelName, db.session))
+
+
+class LazyAdmin:
+    """WSGI middleware that builds the admin on the first /admin request.
+
+    Flask does not accept new blueprints once it served a request, so the
+    admin lives in its own Flask app with the same config and database,
+    created on demand and reused afterwards. The response cache and the
+    favorites index are module level objects, the admin's writes reach the
+    same backend the API reads from.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.admin_app = None
+        self._lock = threading.Lock()
+        app.wsgi_app = self
+
+    def _get_admin_app(self):
+        with self._lock:
+            if self.admin_app is None:
+                admin_app = Flask(self.app.import_name)
+                admin_app.config.update(self.app.config)
+                db.init_app(admin_app)
+                setup_admin(admin_app)
+                self.admin_app = admin_app
+        return self.admin_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == '/admin' or path.startswith('/admin/'):
+            return self._get_admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def init_admin(app, mode=None):
+    """ADMIN_MODE: lazy (default, built on first access), eager or off."""
+    mode = mode or os.getenv('ADMIN_MODE', 'lazy')
+    if mode == 'eager':
+        setup_admin(app)
+    elif mode == 'lazy':
+        app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+        LazyAdmin(app)
+    return mode != 'off'
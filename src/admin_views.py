@@ -0,0 +1,151 @@
+"""
+Flask-Admin views for large tables. Imported by admin.setup_admin only, so
+Flask-Admin stays out of the app's boot.
+"""
+from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from wtforms.validators import ValidationError
+from sqlalchemy import func, inspect, text
+from models import db, User, Favorites, FAVORITE_KINDS, FAVORITE_KIND_OF
+from search import PREFIX_END, fold_case, prefix_key
+from favorites_index import favorites_index
+from cache import cache
+
+MAX_ADMIN_PAGE_SIZE = 100
+# below this many rows an exact COUNT(*) is cheap enough
+EXACT_COUNT_LIMIT = 100000
+
+
+def estimated_row_count(session, model):
+    """Row count from planner statistics (Postgres) or the id range (SQLite), None if unknown."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        estimate = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+                                   {"table": model.__tablename__}).scalar()
+        # -1 until the table was first analyzed
+        return estimate if estimate is not None and estimate >= 0 else None
+    if dialect == 'sqlite':
+        low, high = session.query(func.min(model.id), func.max(model.id)).one()
+        return high - low + 1 if high is not None else 0
+    return None
+
+
+class EstimatedCountQuery:
+    """The list view's COUNT(*) query, answered from an estimate on big tables.
+
+    Search and filters call query methods such as filter() on it, those
+    return the plain query so narrowed lists still get an exact count.
+    """
+
+    def __init__(self, query, model):
+        self.query = query
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.query, name)
+
+    def scalar(self):
+        estimate = estimated_row_count(self.query.session, self.model)
+        if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+            return estimate
+        return self.query.scalar()
+
+
+class PrefixAjaxModelLoader(QueryAjaxModelLoader):
+    """Ajax lookup for form_ajax_refs that matches the start of one indexed
+    column as an index range scan, instead of ILIKE '%term%' on every row."""
+
+    def __init__(self, name, session, model, column, case_insensitive=True, **options):
+        super().__init__(name, session, model, fields=[column], **options)
+        self.column = column
+        self.case_insensitive = case_insensitive
+
+    def format(self, model):
+        if model is None:
+            return None
+        return getattr(model, self.pk), getattr(model, self.column)
+
+    def get_list(self, term, offset=0, limit=10):
+        column = getattr(self.model, self.column)
+        low, key = term, column
+        if self.case_insensitive:
+            dialect = self.session.get_bind().dialect.name
+            low, key = fold_case(term, dialect), prefix_key(self.model, dialect)
+        query = self.get_query().filter(key >= low, key < low + PREFIX_END).order_by(key)
+        return query.offset(offset).limit(min(limit, MAX_ADMIN_PAGE_SIZE)).all()
+
+
+class ScalableModelView(ModelView):
+    page_size = 50
+    can_set_page_size = True
+    page_size_options = (20, 50, 100)
+    column_default_sort = 'id'
+    # the backrefs would render every related favorite as a select option
+    form_excluded_columns = ('favorites', 'version', 'favorites_count')
+    column_exclude_list = ('version',)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        # ?page_size= is not bounded by Flask-Admin
+        page_size = min(page_size or self.page_size, MAX_ADMIN_PAGE_SIZE)
+        return super().get_list(page, sort_column, sort_desc, search, filters, execute=execute, page_size=page_size)
+
+    def get_count_query(self):
+        return EstimatedCountQuery(super().get_count_query(), self.model)
+
+
+class UserView(ScalableModelView):
+    column_sortable_list = User.sort_fields
+    column_exclude_list = ('password',)
+
+
+class CatalogView(ScalableModelView):
+    def __init__(self, model, session, **kwargs):
+        # only columns with an index, favorites_count included
+        self.column_sortable_list = model.sort_fields + ('favorites_count',)
+        super().__init__(model, session, **kwargs)
+
+    def after_model_change(self, form, model, is_created):
+        # the API's cached lists, items and searches of this table
+        cache.bump(model.__tablename__)
+
+    def on_model_delete(self, model):
+        # the delete trigger takes the row's favorites with it, remember whose they were
+        model.favorite_user_ids = Favorites.user_ids_of(FAVORITE_KIND_OF[type(model)], [model.id])
+
+    def after_model_delete(self, model):
+        cache.bump(model.__tablename__)
+        for user_id in getattr(model, 'favorite_user_ids', ()):
+            favorites_index.invalidate(user_id)
+
+
+class FavoritesView(ScalableModelView):
+    column_list = ('id', 'user_id', 'entity_type', 'entity_id')
+    column_sortable_list = ('id', 'user_id')
+    form_columns = ('user', 'entity_type', 'entity_id')
+    form_choices = {'entity_type': [(kind, kind) for kind in FAVORITE_KINDS]}
+    form_ajax_refs = {
+        'user': PrefixAjaxModelLoader('user', db.session, User, 'username', case_insensitive=False),
+    }
+
+    def on_model_change(self, form, model, is_created):
+        # runs before the commit, so the counters commit with the favorite as in Favorites.add
+        state = inspect(model)
+        kinds, ids = state.attrs.entity_type.history, state.attrs.entity_id.history
+        # entity_id has no foreign key, nothing else stops a favorite of a missing row
+        entity_model = FAVORITE_KINDS.get(model.entity_type)
+        if entity_model is None or model.entity_id is None or db.session.get(entity_model, model.entity_id) is None:
+            raise ValidationError("There is no %s with id %s" % (model.entity_type, model.entity_id))
+        if not is_created and (kinds.deleted or ids.deleted):
+            old_kind = (kinds.deleted or kinds.unchanged)[0]
+            Favorites._adjust_counts(old_kind, [(ids.deleted or ids.unchanged)[0]], -1)
+        if is_created or kinds.added or ids.added:
+            Favorites._adjust_counts(model.entity_type, [model.entity_id], 1)
+
+    def on_model_delete(self, model):
+        Favorites._adjust_counts(model.entity_type, [model.entity_id], -1)
+
+    def after_model_change(self, form, model, is_created):
+        favorites_index.invalidate(model.user_id)
+
+    def after_model_delete(self, model):
+        favorites_index.invalidate(model.user_id)
@@ -2,16 +2,29 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import click
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, People, Planets, Vehicles, Favorites
+from sqlalchemy import Integer, String, insert, update, delete, select
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import joinedload
+from itertools import islice
+from utils import APIException, FastJSONProvider, generate_sitemap, require_internal_token, keyset_list_response, read_json_records, next_page_headers
+from admin import init_admin
+from cache import cache
+from favorites_index import favorites_index
+from pooling import engine_options_from_env, pool_stats
+from metrics import metrics
+from compression import compression
+from replicas import replicas
+from search import search, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from export import export_response
+from catalog_import import import_records, read_records, detect_format, Progress, FORMATS, DEFAULT_CHUNK_SIZE
+from models import db, User, People, Planets, Vehicles, Favorites, FAVORITE_KINDS, FAVORITE_KIND_OF, reconcile_favorite_counts
 #from models import Person
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.url_map.strict_slashes = False
 
 db_url = os.getenv("DATABASE_URL")
@@ -20,11 +33,24 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['BULK_CHUNK_SIZE'] = int(os.getenv('BULK_CHUNK_SIZE', 1000))
 
-MIGRATE = Migrate(app, db)
+if os.getenv('FLASK_RUN_FROM_CLI') == 'true':
+    # only the flask command (flask db ...) needs Flask-Migrate and alembic
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
 db.init_app(app)
+cache.init_app(app)
+# sticky read-your-writes windows live next to the cached responses
+replicas.init_app(app, store=cache.backend)
+# per-user versions there as well, so a write on one worker reaches the others
+favorites_index.init_app(app, store=cache.backend)
+metrics.init_app(app)
+# after metrics, so http_response_size_bytes records the compressed size
+compression.init_app(app)
 CORS(app)
-setup_admin(app)
+ADMIN_ENABLED = init_admin(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -32,9 +58,37 @@ def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
+SITEMAP_HTML = None
+
 @app.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    # the url map does not change once the app is serving, build the page once
+    global SITEMAP_HTML
+    if SITEMAP_HTML is None:
+        SITEMAP_HTML = generate_sitemap(app, admin=ADMIN_ENABLED)
+    return SITEMAP_HTML
+
+
+if os.getenv('SWAGGER_ENABLED', '0') not in ('0', 'false'):
+    @app.route('/swagger.json')
+    def swagger_spec():
+        # imported on first use, it pulls in yaml and is only for documentation
+        from flask_swagger import swagger
+        return jsonify(swagger(app)), 200
+
+@app.route('/internal/pool', methods=['GET'])
+def get_pool_stats():
+    # per worker numbers, every gunicorn worker has its own pool
+    require_internal_token()
+    stats = pool_stats(db.engine)
+    stats["pid"] = os.getpid()
+    stats["replicas"] = [pool_stats(engine) for engine in replicas.engines]
+    return jsonify(stats), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    require_internal_token()
+    return metrics.collect(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 @app.route('/user', methods=['GET'])
 def handle_hello():
@@ -46,117 +100,256 @@ def handle_hello():
     return jsonify(response_body), 200
 
 @app.route('/people', methods=['GET'])
+@cache.cached('people')
+@replicas.read_only
 def get_people():
     try:
-        characters = People.query.all()
-        new_character_list = []
-        for character in characters:
-            new_character_list.append(character.serialize())
-        return jsonify(new_character_list), 200
+        return keyset_list_response(People)
+    except APIException:
+        raise
     except:
         return jsonify({'message': 'Server error'}), 500
 
 @app.route('/people/<int:people_id>', methods=['GET'])
+@cache.cached('people')
+@replicas.read_only
 def get_single_people(people_id):
     try:
         character = People.query.get(people_id)
         if character:
-            return jsonify(character.serialize()), 200
+            response = jsonify(character.serialize())
+            response.set_etag(str(character.version))
+            return response, 200
         else:
             return jsonify({"message": "Character not found"}), 404
     except:
         return jsonify({"message": "Server error"}), 500
 
 @app.route('/planets', methods=['GET'])
+@cache.cached('planets')
+@replicas.read_only
 def get_planets():
     try:
-        planets = Planets.query.all()
-        new_planets_list = []
-        for planet in planets:
-            new_planets_list.append(planet.serialize())
-        return jsonify(new_planets_list), 200
+        return keyset_list_response(Planets)
+    except APIException:
+        raise
     except:
         return jsonify({"message": "Server error"}), 500
 
 
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@cache.cached('planets')
+@replicas.read_only
 def get_single_planet(planet_id):
     try:
         planet = Planets.query.get(planet_id)
         if planet:
-            return jsonify(planet.serialize()), 200
+            response = jsonify(planet.serialize())
+            response.set_etag(str(planet.version))
+            return response, 200
         else:
             return jsonify({"message": "Planet not found"}), 404
     except:
         return jsonify({"message": "Server error"}), 500
 
 @app.route('/vehicles', methods=['GET'])
+@cache.cached('vehicles')
+@replicas.read_only
 def get_vehicles():
     try:
-        machines = Vehicles.query.all()
-        new_machines_list = []
-        for machine in machines:
-            new_machines_list.append(machine.serialize())
-        return jsonify(new_machines_list), 200
+        return keyset_list_response(Vehicles)
+    except APIException:
+        raise
     except:
         return jsonify({"message": "Server error"}), 500
 
 
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
+@cache.cached('vehicles')
+@replicas.read_only
 def get_single_vehicle(vehicle_id):
     try:
         machine = Vehicles.query.get(vehicle_id)
         if machine:
-            return jsonify(machine.serialize()), 200
+            response = jsonify(machine.serialize())
+            response.set_etag(str(machine.version))
+            return response, 200
         else:
             return jsonify({"message": "Vehicle not found"}), 404
     except:
         return jsonify({"message": "Server error"}), 500
 
 
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+
+def favorites_top(model):
+    # walks ix_<table>_favorites_count backwards, no GROUP BY over Favorites
+    try:
+        limit = int(request.args.get('limit', TOP_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({"message": "limit must be a positive integer"}), 400
+    limit = min(limit, TOP_MAX_LIMIT)
+    fields = model.serialize_fields + ('favorites_count',)
+    stmt = (select(*[getattr(model, name) for name in fields])
+            .where(model.favorites_count > 0)
+            .order_by(model.favorites_count.desc(), model.id.desc())
+            .limit(limit))
+    return jsonify([dict(zip(fields, row)) for row in db.session.execute(stmt)]), 200
+
+
+@app.route('/people/top', methods=['GET'])
+@replicas.read_only
+def get_people_top():
+    try:
+        return favorites_top(People)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/planets/top', methods=['GET'])
+@replicas.read_only
+def get_planets_top():
+    try:
+        return favorites_top(Planets)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/vehicles/top', methods=['GET'])
+@replicas.read_only
+def get_vehicles_top():
+    try:
+        return favorites_top(Vehicles)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/search', methods=['GET'])
+@cache.cached('people', 'planets', 'vehicles')
+@replicas.read_only
+def search_names():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"message": "Missing required parameter: q"}), 400
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({"message": "limit must be a positive integer"}), 400
+    limit = min(limit, MAX_SEARCH_LIMIT)
+    try:
+        results, next_cursor = search(q, limit, request.args.get('after'))
+    except APIException:
+        raise
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+    response = jsonify(results)
+    if next_cursor is not None:
+        response.headers.extend(next_page_headers(request.path, request.args, limit, next_cursor))
+    return response, 200
+
+
+@app.route('/export/<table>', methods=['GET'])
+@replicas.read_only
+def export_table(table):
+    # full copies for analytics, read from a replica when there is one
+    require_internal_token()
+    return export_response(table, request.args.get('format', 'ndjson'), request.args.get('after_id'))
+
+
 @app.route('/users', methods=['GET'])
+@replicas.read_only
 def get_users():
     try:
-        starwars_fans = User.query.all()
-        new_starwars_fans_list = []
-        for starwars_fan in starwars_fans:
-            new_starwars_fans_list.append(starwars_fan.serialize())
-        return jsonify(new_starwars_fans_list), 200
+        return keyset_list_response(User)
+    except APIException:
+        raise
     except:
         return jsonify({'message': 'Server error'}), 500
 
 
 @app.route('/users/favorites', methods=['GET'])
+@replicas.read_only
 def get_user_favorites():
     try:
         user_id = request.args.get('user_id')  # Se debe asignar un params desde el postman con el id del user que tiene favoritos
         
-        user_favorites = Favorites.query.filter_by(user_id=user_id).all() # Buscar todos los favoritos del usuario actual
-        
-        serialized_favorites = [favorite.serialize() for favorite in user_favorites] # Serializar los resultados
+        expand = request.args.get('expand', '').lower() in ('1', 'true', 'yes')
+
+        query = Favorites.query.filter_by(user_id=user_id).order_by(Favorites.id) # Buscar todos los favoritos del usuario actual
+        if expand:
+            # cargar planet/people/vehicle en la misma consulta para evitar N+1
+            query = query.options(joinedload(Favorites.planet), joinedload(Favorites.people), joinedload(Favorites.vehicle))
+        user_favorites = query.all()
+
+        if expand:
+            serialized_favorites = [favorite.serialize_expanded() for favorite in user_favorites]
+        else:
+            serialized_favorites = [favorite.serialize() for favorite in user_favorites] # Serializar los resultados
 
         return jsonify(serialized_favorites), 200
     except:
         return jsonify({'message': 'Server error'}), 500
 
 
+MAX_CONTAINS_IDS = 1000
+
+@app.route('/users/<int:user_id>/favorites/contains', methods=['GET'])
+# not read_only: the index is loaded from the primary, once per user, and kept
+def user_favorites_contains(user_id):
+    # ?planet_ids=1,2,3&people_ids=...&vehicle_ids=..., answers with the ids that are favorites
+    ids_by_kind = {}
+    for kind in FAVORITE_KINDS:
+        try:
+            ids = [int(value) for value in request.args.get(kind + '_ids', '').split(',') if value.strip()]
+        except ValueError:
+            return jsonify({"message": "%s_ids must be a comma separated list of integers" % kind}), 400
+        if len(ids) > MAX_CONTAINS_IDS:
+            return jsonify({"message": "At most %d %s_ids per request" % (MAX_CONTAINS_IDS, kind)}), 400
+        if kind + '_ids' in request.args:
+            ids_by_kind[kind] = ids
+    if not ids_by_kind:
+        return jsonify({"message": "Missing required parameter: planet_ids, people_ids or vehicle_ids"}), 400
+
+    try:
+        contained = favorites_index.contains(user_id, ids_by_kind)
+        return jsonify({kind + '_ids': ids for kind, ids in contained.items()}), 200
+    except Exception as e:
+        print(str(e))
+        return jsonify({"message": "Server error"}), 500
+
+
+def user_id_arg():
+    # parsed before the write, favorites_index needs an int once the favorite is committed
+    try:
+        return int(request.args.get('user_id', ''))
+    except ValueError:
+        raise APIException("user_id must be an integer", status_code=400)
+
+
 @app.route('/favorite/planet/<int:planet_id>', methods=['POST'])  
 def add_fav_planet(planet_id):
+        user_id = user_id_arg()
         try:
-            user_id = request.args.get('user_id')
-            existing_favorite = Favorites.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-
-            if existing_favorite:
-                return jsonify({"message": "Is already a favorite planet of the user"}), 400
-            
-            planet = Planets.query.get(planet_id)
-            if not planet:
-                return jsonify({"message": "Planet does not exist"}), 404
-            
-            new_favorite = Favorites(user_id=user_id, planet_id=planet_id)
-            db.session.add(new_favorite)
+            inserted = Favorites.add(user_id, 'planet', planet_id)
             db.session.commit()
-            return jsonify({"message": "Planet set as favorite"}), 200
+
+            if inserted:
+                favorites_index.update(user_id, 'planet', added=[planet_id])
+                return jsonify({"message": "Planet set as favorite"}), 200
+            # nothing inserted: either the planet is missing or it was already a favorite
+            if db.session.get(Planets, planet_id) is None:
+                return jsonify({"message": "Planet does not exist"}), 404
+            return jsonify({"message": "Is already a favorite planet of the user"}), 400
 
         except Exception as e:
             print(str(e))
@@ -165,21 +358,18 @@ def add_fav_planet(planet_id):
 
 @app.route('/favorite/people/<int:people_id>', methods=['POST'])
 def add_fav_people(people_id):
+        user_id = user_id_arg()
         try:
-            user_id = request.args.get('user_id')
-            existing_favorite = Favorites.query.filter_by(user_id=user_id, people_id=people_id).first()
-
-            if existing_favorite:
-                return jsonify({"message": "Is already a favorite people of the user"}), 400
-            
-            people = People.query.get(people_id)
-            if not people:
-                return jsonify({"message": "People does not exist"}), 404
-            
-            new_favorite = Favorites(user_id=user_id, people_id=people_id)
-            db.session.add(new_favorite)
+            inserted = Favorites.add(user_id, 'people', people_id)
             db.session.commit()
-            return jsonify({"message": "people set as favorite"}), 200
+
+            if inserted:
+                favorites_index.update(user_id, 'people', added=[people_id])
+                return jsonify({"message": "people set as favorite"}), 200
+            # nothing inserted: either the people is missing or it was already a favorite
+            if db.session.get(People, people_id) is None:
+                return jsonify({"message": "People does not exist"}), 404
+            return jsonify({"message": "Is already a favorite people of the user"}), 400
 
         except Exception as e:
             print(str(e))
@@ -188,21 +378,18 @@ def add_fav_people(people_id):
 
 @app.route('/favorite/vehicle/<int:vehicle_id>', methods=['POST'])
 def add_fav_vehicles(vehicle_id):
+        user_id = user_id_arg()
         try:
-            user_id = request.args.get('user_id')
-            existing_favorite = Favorites.query.filter_by(user_id=user_id, vehicle_id=vehicle_id).first()
-
-            if existing_favorite:
-                return jsonify({"message": "Is already a favorite vehicle of the user"}), 400
-            
-            vehicle = Vehicles.query.get(vehicle_id)
-            if not vehicle:
-                return jsonify({"message": "Vehicle does not exist"}), 404
-            
-            new_favorite = Favorites(user_id=user_id, vehicle_id=vehicle_id)
-            db.session.add(new_favorite)
+            inserted = Favorites.add(user_id, 'vehicle', vehicle_id)
             db.session.commit()
-            return jsonify({"message": "vehicles set as favorite"}), 200
+
+            if inserted:
+                favorites_index.update(user_id, 'vehicle', added=[vehicle_id])
+                return jsonify({"message": "vehicles set as favorite"}), 200
+            # nothing inserted: either the vehicle is missing or it was already a favorite
+            if db.session.get(Vehicles, vehicle_id) is None:
+                return jsonify({"message": "Vehicle does not exist"}), 404
+            return jsonify({"message": "Is already a favorite vehicle of the user"}), 400
 
         except Exception as e:
             print(str(e))
@@ -210,13 +397,13 @@ def add_fav_vehicles(vehicle_id):
 
 @app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 def delete_fav_planet(planet_id):
+    user_id = user_id_arg()
     try:
-        user_id = request.args.get('user_id')
-        favorite_to_delete = Favorites.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-        
-        if favorite_to_delete:
-            db.session.delete(favorite_to_delete)
-            db.session.commit()
+        deleted = Favorites.remove(user_id, 'planet', planet_id)
+        db.session.commit()
+
+        if deleted:
+            favorites_index.update(user_id, 'planet', removed=[planet_id])
             return jsonify({"message": "Favorite Planet deleted"}), 200
         else:
             return jsonify({"message": "Favorite Planet not found"}), 404
@@ -227,13 +414,13 @@ def delete_fav_planet(planet_id):
 
 @app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
 def delete_fav_people(people_id):
+    user_id = user_id_arg()
     try:
-        user_id = request.args.get('user_id')
-        favorite_to_delete = Favorites.query.filter_by(user_id=user_id, people_id=people_id).first()
-        
-        if favorite_to_delete:
-            db.session.delete(favorite_to_delete)
-            db.session.commit()
+        deleted = Favorites.remove(user_id, 'people', people_id)
+        db.session.commit()
+
+        if deleted:
+            favorites_index.update(user_id, 'people', removed=[people_id])
             return jsonify({"message": "Favorite People deleted"}), 200
         else:
             return jsonify({"message": "Favorite People not found"}), 404
@@ -245,13 +432,13 @@ def delete_fav_people(people_id):
 
 @app.route('/favorite/vehicle/<int:vehicle_id>', methods=['DELETE'])
 def delete_fav_vehicle(vehicle_id):
+    user_id = user_id_arg()
     try:
-        user_id = request.args.get('user_id')
-        favorite_to_delete = Favorites.query.filter_by(user_id=user_id, vehicle_id=vehicle_id).first()
-        
-        if favorite_to_delete:
-            db.session.delete(favorite_to_delete)
-            db.session.commit()
+        deleted = Favorites.remove(user_id, 'vehicle', vehicle_id)
+        db.session.commit()
+
+        if deleted:
+            favorites_index.update(user_id, 'vehicle', removed=[vehicle_id])
             return jsonify({"message": "Favorite Vehicle deleted"}), 200
         else:
             return jsonify({"message": "Favorite Vehicle not found"}), 404
@@ -261,10 +448,169 @@ def delete_fav_vehicle(vehicle_id):
             return jsonify({"message": "Server error"}), 500
 
 
+def parse_favorites_batch():
+    # accepts [{"kind": "planet", "id": 1}, ...] or {"favorites": [...]}
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('favorites')
+    if not isinstance(data, list):
+        raise APIException("Expected a list of favorites", status_code=400)
+
+    items = []
+    ids_by_kind = {kind: set() for kind in FAVORITE_KINDS}
+    for item in data:
+        kind = item.get('kind') if isinstance(item, dict) else None
+        entity_id = item.get('id') if isinstance(item, dict) else None
+        if kind not in FAVORITE_KINDS or not isinstance(entity_id, int):
+            items.append({"kind": kind, "id": entity_id, "status": "invalid"})
+            continue
+        items.append({"kind": kind, "id": entity_id})
+        ids_by_kind[kind].add(entity_id)
+    return items, ids_by_kind
+
+
+@app.route('/users/<int:user_id>/favorites:batch', methods=['POST'])
+def add_favorites_batch(user_id):
+    items, ids_by_kind = parse_favorites_batch()
+    try:
+        if db.session.get(User, user_id) is None:
+            return jsonify({"message": "User not found"}), 404
+
+        found, already = {}, {}
+        for kind, ids in ids_by_kind.items():
+            model = FAVORITE_KINDS[kind]
+            found[kind] = {row[0] for row in db.session.query(model.id).filter(model.id.in_(ids))} if ids else set()
+            already[kind] = Favorites.existing_ids(user_id, kind, found[kind])
+            Favorites.add_many(user_id, kind, found[kind] - already[kind])
+        db.session.commit()
+        for kind in FAVORITE_KINDS:
+            if found[kind] - already[kind]:
+                favorites_index.update(user_id, kind, added=found[kind] - already[kind])
+
+        added = set()
+        for item in items:
+            if 'status' in item:
+                continue
+            key = (item['kind'], item['id'])
+            if item['id'] not in found[item['kind']]:
+                item['status'] = "not_found"
+            elif item['id'] in already[item['kind']] or key in added:
+                item['status'] = "already_favorite"
+            else:
+                item['status'] = "added"
+                added.add(key)
+        return jsonify({"results": items}), 200
+
+    except Exception as e:
+        print(str(e))
+        return jsonify({"message": "Server error"}), 500
+
+
+@app.route('/users/<int:user_id>/favorites:batch', methods=['DELETE'])
+def delete_favorites_batch(user_id):
+    items, ids_by_kind = parse_favorites_batch()
+    try:
+        existing = {}
+        for kind, ids in ids_by_kind.items():
+            existing[kind] = Favorites.existing_ids(user_id, kind, ids)
+            Favorites.remove_many(user_id, kind, existing[kind])
+        db.session.commit()
+        for kind in FAVORITE_KINDS:
+            if existing[kind]:
+                favorites_index.update(user_id, kind, removed=existing[kind])
+
+        deleted = set()
+        for item in items:
+            if 'status' in item:
+                continue
+            key = (item['kind'], item['id'])
+            if item['id'] in existing[item['kind']] and key not in deleted:
+                item['status'] = "deleted"
+                deleted.add(key)
+            else:
+                item['status'] = "not_found"
+        return jsonify({"results": items}), 200
+
+    except Exception as e:
+        print(str(e))
+        return jsonify({"message": "Server error"}), 500
+
+
+# maintained by the database or by Favorites, never written from request bodies
+READ_ONLY_COLUMNS = ('id', 'version', 'favorites_count')
+
+
+def insert_chunk(model, rows):
+    # one executemany per chunk, if it fails retry row by row to find the bad ones
+    errors = []
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model), [row for _, row in rows])
+        return len(rows), errors
+    except SQLAlchemyError:
+        pass
+    created = 0
+    for index, row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(model), [row])
+            created += 1
+        except SQLAlchemyError as e:
+            errors.append({"index": index, "name": row.get('name'), "error": str(e.orig if hasattr(e, 'orig') else e)})
+    return created, errors
+
+
+def bulk_create(model, records):
+    fields = [column.name for column in model.__table__.columns if column.name not in READ_ONLY_COLUMNS]
+    chunk_size = request.args.get('chunk_size', app.config['BULK_CHUNK_SIZE'], type=int)
+    created, errors, seen = 0, [], set()
+    records = enumerate(records)
+    try:
+        while True:
+            chunk = list(islice(records, max(chunk_size, 1)))
+            if not chunk:
+                break
+            rows = []
+            for index, (record, error) in chunk:
+                if error is None and not isinstance(record, dict):
+                    error = "Expected a JSON object"
+                elif error is None and not record.get('name'):
+                    error = "Missing required field: name"
+                elif error is None and not isinstance(record['name'], str):
+                    # checked before the set lookup, a list or object name is unhashable
+                    error = "name must be a string"
+                elif error is None and record['name'] in seen:
+                    error = "Duplicated name in request: %s" % record['name']
+                if error:
+                    errors.append({"index": index, "name": record.get('name') if isinstance(record, dict) else None, "error": error})
+                    continue
+                seen.add(record['name'])
+                rows.append((index, {field: record.get(field) for field in fields}))
+
+            names = [row['name'] for _, row in rows]
+            existing = {name for (name,) in db.session.query(model.name).filter(model.name.in_(names))} if names else set()
+            for index, row in rows:
+                if row['name'] in existing:
+                    errors.append({"index": index, "name": row['name'], "error": "Name already exists: %s" % row['name']})
+            chunk_created, chunk_errors = insert_chunk(model, [(i, row) for i, row in rows if row['name'] not in existing])
+            created += chunk_created
+            errors.extend(chunk_errors)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"message": "Invalid JSON body", "error": str(e)}), 400
+
+    db.session.commit()
+    cache.bump(model.__tablename__)
+    errors.sort(key=lambda error: error['index'])
+    return jsonify({"message": "%d rows created" % created, "created": created, "errors": errors}), 201 if not errors else 207
+
+
 @app.route('/create/planet/', methods=['POST'])
 def create_planet():
     try:
-        data = request.json
+        data, records = read_json_records()
+        if records is not None:
+            return bulk_create(Planets, records)
         
         if 'name' not in data:
             return jsonify({"message": "Missing required field: name"}), 400
@@ -279,6 +625,7 @@ def create_planet():
 
         db.session.add(new_planet)
         db.session.commit()
+        cache.bump('planets')
 
         return jsonify({"message": "Planet created successfully", "planet": new_planet.serialize()}), 201
     
@@ -290,7 +637,9 @@ def create_planet():
 @app.route('/create/people/', methods=['POST'])
 def create_people():
     try:
-        data = request.json
+        data, records = read_json_records()
+        if records is not None:
+            return bulk_create(People, records)
 
         if 'name' not in data:
             return jsonify({"message": "Missing required field: name"}), 400  
@@ -305,6 +654,7 @@ def create_people():
 
         db.session.add(new_people)
         db.session.commit()
+        cache.bump('people')
 
         return jsonify({"message": "People created successfully", "People": new_people.serialize()}), 201  
     
@@ -316,7 +666,9 @@ def create_people():
 @app.route('/create/vehicle/', methods=['POST'])
 def create_vehicle():
     try:
-        data = request.json
+        data, records = read_json_records()
+        if records is not None:
+            return bulk_create(Vehicles, records)
 
         if 'name' not in data:
             return jsonify({"message": "Missing required field: name"}), 400  
@@ -332,6 +684,7 @@ def create_vehicle():
 
         db.session.add(new_vehicle)
         db.session.commit()
+        cache.bump('vehicles')
 
         return jsonify({"message": "Vehicle created successfully", "Vehicle": new_vehicle.serialize()}), 201
     
@@ -361,6 +714,7 @@ def update_person(people_id):
             person.gender = data['gender']
 
         db.session.commit()
+        cache.bump('people')
 
         return jsonify({'message': 'Person updated successfully'}), 200  
     except Exception as e:
@@ -390,6 +744,7 @@ def update_planet(planet_id):
             planet.diameter = data['diameter']
 
         db.session.commit()
+        cache.bump('planets')
 
         return jsonify({'message': 'Planet updated successfully'}), 200  
     except Exception as e:
@@ -420,22 +775,133 @@ def update_vehicle(vehicle_id):
             vehicle.length = data['length']
 
         db.session.commit()
+        cache.bump('vehicles')
 
         return jsonify({'message': 'Vehicle updated successfully'}), 200  
     except Exception as e:
         print(str(e))
         return jsonify({'message': 'Server error'}), 500
 
+def field_type_error(column, value):
+    # checked before the UPDATE, Postgres would only reject a bad value at execute time
+    if value is None:
+        return None if column.nullable else "%s can not be null" % column.key
+    if isinstance(column.type, Integer):
+        if not isinstance(value, int) or isinstance(value, bool):
+            return "%s must be an integer" % column.key
+        if not -2 ** 31 <= value < 2 ** 31:
+            return "%s is out of range" % column.key
+    elif isinstance(column.type, String):
+        if not isinstance(value, str):
+            return "%s must be a string" % column.key
+        if column.type.length is not None and len(value) > column.type.length:
+            return "%s is longer than %d characters" % (column.key, column.type.length)
+    return None
+
+
+def patch_entity(model, entity_id, not_found_message):
+    """Partial update in a single UPDATE ... WHERE id AND version statement.
+
+    The version comes from If-Match (the ETag of GET /<entity>/<id>), a
+    stale version answers 412. Without If-Match the update is unconditional.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({"message": "Expected a JSON object with the fields to update"}), 400
+    editable = [column.key for column in model.__table__.columns if column.key not in READ_ONLY_COLUMNS]
+    unknown = [key for key in data if key not in editable]
+    if unknown:
+        return jsonify({"message": "Unknown or read-only fields: %s" % ", ".join(unknown)}), 400
+    errors = [error for error in (field_type_error(model.__table__.columns[key], value) for key, value in data.items())
+              if error is not None]
+    if errors:
+        return jsonify({"message": "; ".join(errors)}), 400
+
+    stmt = update(model).where(model.id == entity_id).values(version=model.version + 1, **data)
+    if request.if_match and not request.if_match.star_tag:
+        tags = list(request.if_match.as_set())
+        if len(tags) != 1 or not tags[0].isdigit():
+            return jsonify({"message": "If-Match must be a single ETag returned by a GET"}), 412
+        stmt = stmt.where(model.version == int(tags[0]))
+    stmt = stmt.execution_options(synchronize_session=False)
+
+    columns = [getattr(model, name) for name in model.serialize_fields] + [model.version]
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            row = db.session.execute(stmt.returning(*columns)).first()
+        elif db.session.execute(stmt).rowcount:
+            row = db.session.execute(select(*columns).where(model.id == entity_id)).first()
+        else:
+            row = None
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({"message": "Update violates a constraint", "error": str(e.orig)}), 409
+
+    if row is None:
+        # nothing matched: either the row is gone or the version is stale
+        if db.session.get(model, entity_id) is None:
+            return jsonify({"message": not_found_message}), 404
+        return jsonify({"message": "The resource was modified, fetch it again"}), 412
+
+    cache.bump(model.__tablename__)
+    response = jsonify(dict(zip(model.serialize_fields, row)))
+    response.set_etag(str(row.version))
+    return response, 200
+
+
+@app.route('/update/people/<int:people_id>', methods=['PATCH'])
+def patch_person(people_id):
+    try:
+        return patch_entity(People, people_id, "Person not found")
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/update/planet/<int:planet_id>', methods=['PATCH'])
+def patch_planet(planet_id):
+    try:
+        return patch_entity(Planets, planet_id, "Planet not found")
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/update/vehicle/<int:vehicle_id>', methods=['PATCH'])
+def patch_vehicle(vehicle_id):
+    try:
+        return patch_entity(Vehicles, vehicle_id, "Vehicle not found")
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+def delete_entities(model, ids):
+    """DELETE by id, nothing is loaded. The delete trigger removes the rows'
+    favorites inside the database, so the users they belonged to are read
+    first. Returns (deleted, user_ids), call forget_favorites after the commit."""
+    user_ids = Favorites.user_ids_of(FAVORITE_KIND_OF[model], ids)
+    deleted = db.session.execute(delete(model).where(model.id.in_(ids))).rowcount
+    return deleted, user_ids
+
+
+def forget_favorites(user_ids):
+    for user_id in user_ids:
+        favorites_index.invalidate(user_id)
+
+
 @app.route('/delete/people/<int:people_id>', methods=['DELETE'])
 def delete_person(people_id):
     try:
-        person = People.query.get(people_id)
+        deleted, user_ids = delete_entities(People, [people_id])
 
-        if person is None:
+        if not deleted:
             return jsonify({'message': 'Person not found'}), 404  
 
-        db.session.delete(person)
         db.session.commit()
+        cache.bump('people')
+        forget_favorites(user_ids)
 
         return jsonify({'message': 'Person deleted successfully'}), 200  
     except Exception as e:
@@ -446,13 +912,14 @@ def delete_person(people_id):
 @app.route('/delete/planet/<int:planet_id>', methods=['DELETE'])
 def delete_planet(planet_id):
     try:
-        planet = Planets.query.get(planet_id)
+        deleted, user_ids = delete_entities(Planets, [planet_id])
 
-        if planet is None:
+        if not deleted:
             return jsonify({'message': 'Planet not found'}), 404  
 
-        db.session.delete(planet)
         db.session.commit()
+        cache.bump('planets')
+        forget_favorites(user_ids)
 
         return jsonify({'message': 'Planet deleted successfully'}), 200  
     except Exception as e:
@@ -463,19 +930,114 @@ def delete_planet(planet_id):
 @app.route('/delete/vehicle/<int:vehicle_id>', methods=['DELETE'])
 def delete_vehicle(vehicle_id):
     try:
-        vehicle = Vehicles.query.get(vehicle_id)
+        deleted, user_ids = delete_entities(Vehicles, [vehicle_id])
 
-        if vehicle is None:
+        if not deleted:
             return jsonify({'message': 'Vehicle not found'}), 404  
 
-        db.session.delete(vehicle)
         db.session.commit()
+        cache.bump('vehicles')
+        forget_favorites(user_ids)
 
         return jsonify({'message': 'Vehicle deleted successfully'}), 200  
     except Exception as e:
         print(str(e))
         return jsonify({'message': 'Server error'}), 500
 
+
+MAX_BULK_DELETE = 1000
+
+def bulk_delete(model):
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return jsonify({"message": "ids must be a comma separated list of integers"}), 400
+    if not ids:
+        return jsonify({"message": "Missing required parameter: ids"}), 400
+    if len(ids) > MAX_BULK_DELETE:
+        return jsonify({"message": "At most %d ids per request" % MAX_BULK_DELETE}), 400
+
+    deleted, user_ids = delete_entities(model, ids)
+    db.session.commit()
+    cache.bump(model.__tablename__)
+    forget_favorites(user_ids)
+    return jsonify({"message": "%d deleted" % deleted, "deleted": deleted}), 200
+
+
+@app.route('/people', methods=['DELETE'])
+def delete_people_bulk():
+    try:
+        return bulk_delete(People)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/planets', methods=['DELETE'])
+def delete_planets_bulk():
+    try:
+        return bulk_delete(Planets)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.route('/vehicles', methods=['DELETE'])
+def delete_vehicles_bulk():
+    try:
+        return bulk_delete(Vehicles)
+    except Exception as e:
+        print(str(e))
+        return jsonify({'message': 'Server error'}), 500
+
+
+@app.cli.command('reconcile-favorites')
+def reconcile_favorites_command():
+    """Rebuilds favorites_count of people, planets and vehicles."""
+    fixed = reconcile_favorite_counts()
+    db.session.commit()
+    for table, count in fixed.items():
+        print('%s: %d counters corrected' % (table, count))
+
+
+SEED_MODELS = {'people': People, 'planets': Planets, 'vehicles': Vehicles}
+
+
+def seed_model_for(path):
+    # SWAPI file names: people.json, planets.csv, vehicles.ndjson...
+    name = os.path.basename(path).lower()
+    for kind, model in SEED_MODELS.items():
+        if kind.rstrip('s') in name or (kind == 'people' and 'person' in name):
+            return model
+    return None
+
+
+@app.cli.command('seed')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(list(SEED_MODELS)), help="Target table, guessed from the file name by default.")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="File format, guessed from the extension by default.")
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help="Rows per write.")
+def seed_command(paths, kind, fmt, chunk_size):
+    """Upserts SWAPI people, planets or vehicles files by name."""
+    for path in paths:
+        model = SEED_MODELS[kind] if kind else seed_model_for(path)
+        if model is None:
+            raise click.UsageError("Can't tell people, planets or vehicles from %s, use --kind" % path)
+        fields = [column.name for column in model.__table__.columns if column.name not in READ_ONLY_COLUMNS]
+        progress = Progress('%s <- %s' % (model.__tablename__, path))
+        try:
+            inserted, updated, skipped = import_records(model, read_records(path, fmt or detect_format(path)),
+                                                        fields, max(chunk_size, 1), progress)
+            db.session.commit()
+        except (ValueError, SQLAlchemyError) as e:
+            db.session.rollback()
+            raise click.ClickException("%s: %s" % (path, e))
+        cache.bump(model.__tablename__)
+        elapsed, rate = progress.rate()
+        unchanged = progress.rows - inserted - updated - skipped
+        print('%s: %d rows in %.1fs (%.0f rows/s), %d inserted, %d updated, %d unchanged, %d skipped without a name' % (
+            model.__tablename__, progress.rows, elapsed, rate, inserted, updated, unchanged, skipped))
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,193 @@
+"""
+ASGI entry point for I/O bound deployments.
+
+The catalog and favorites read endpoints are served natively with the
+SQLAlchemy asyncio engine, so one worker keeps many requests in flight
+while they wait on the database. Every other path (writes, admin, metrics)
+falls through to the regular Flask app. Responses have the same JSON shapes
+as the Flask views.
+
+    pipenv install uvicorn asgiref aiosqlite asyncpg
+    uvicorn asgi:application --app-dir src --workers 2
+"""
+import re
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie, parse_etags, quote_etag
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload
+from app import app as flask_app
+from models import User, People, Planets, Vehicles, Favorites
+from pooling import engine_options_from_env
+from replicas import replicas, STICKY_COOKIE
+from utils import (APIException, STREAM_BATCH_SIZE, build_list_query, paginate, split_page,
+                   next_page_headers, wants_stream)
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # without asgiref only the async endpoints are served
+    WsgiToAsgi = None
+
+
+def async_database_url(url):
+    if url.startswith('postgresql://'):
+        return url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    if url.startswith('sqlite://'):
+        return url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+    return url
+
+
+def _async_engine_options(url):
+    options = engine_options_from_env(url)
+    # the asyncio engine needs its own pool class and asyncpg takes
+    # server settings instead of libpq options
+    options.pop('poolclass', None)
+    connect_args = options.pop('connect_args', None)
+    if connect_args and 'options' in connect_args:
+        timeout = connect_args['options'].split('=', 1)[1]
+        options['connect_args'] = {'server_settings': {'statement_timeout': timeout}}
+    return options
+
+
+database_url = flask_app.config['SQLALCHEMY_DATABASE_URI']
+engine = create_async_engine(async_database_url(database_url), **_async_engine_options(database_url))
+replica_engines = [create_async_engine(async_database_url(url), **_async_engine_options(url)) for url in replicas.urls]
+flask_asgi = WsgiToAsgi(flask_app) if WsgiToAsgi is not None else None
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+def dumps(obj):
+    return (flask_app.json.dumps(obj) + '\n').encode()
+
+
+async def send_json(send, status, body, headers=None):
+    raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    raw_headers += [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers + CORS_HEADERS})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def read_engine(scope, args):
+    # same routing and read-your-writes window as replicas.read_only in the Flask views
+    cookies = parse_cookie(b'; '.join(value for key, value in scope['headers'] if key == b'cookie'))
+    index = replicas.pick(cookies.get(STICKY_COOKIE), args.get('user_id'))
+    return engine if index is None else replica_engines[index]
+
+
+async def stream_list(send, engine, stmt, fields):
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')] + CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': b'[', 'more_body': True})
+        first = True
+        async for rows in result.partitions(STREAM_BATCH_SIZE):
+            chunk = ','.join(flask_app.json.dumps(dict(zip(fields, row))) for row in rows)
+            await send({'type': 'http.response.body', 'body': (('' if first else ',') + chunk).encode(), 'more_body': True})
+            first = False
+        await send({'type': 'http.response.body', 'body': b']'})
+
+
+def list_view(model):
+    async def view(send, engine, args, path, headers):
+        stmt, fields, sort = build_list_query(model, args)
+        if wants_stream(args):
+            return await stream_list(send, engine, stmt, fields)
+
+        stmt, limit = paginate(stmt, model, sort, args)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(stmt)).all()
+        if limit is None:
+            return await send_json(send, 200, dumps([dict(zip(fields, row)) for row in rows]))
+
+        rows, next_cursor = split_page(rows, sort, limit)
+        headers = next_page_headers(path, args, limit, next_cursor) if next_cursor is not None else None
+        await send_json(send, 200, dumps([dict(zip(fields, row)) for row in rows]), headers)
+    return view
+
+
+def item_view(model, not_found):
+    async def view(send, engine, args, path, headers, item_id):
+        columns = [getattr(model, name) for name in model.serialize_fields] + [model.version]
+        async with engine.connect() as conn:
+            row = (await conn.execute(select(*columns).where(model.id == int(item_id)))).first()
+        if row is None:
+            return await send_json(send, 404, dumps({"message": not_found}))
+        # the row version as ETag, the one PATCH takes in If-Match
+        etag = quote_etag(str(row.version))
+        if_none_match = headers.get(b'if-none-match')
+        if if_none_match is not None and parse_etags(if_none_match.decode('latin-1')).contains_weak(str(row.version)):
+            return await send_json(send, 304, b'', {'ETag': etag})
+        body = dumps(dict(zip(model.serialize_fields, row[:-1])))
+        await send_json(send, 200, body, {'ETag': etag})
+    return view
+
+
+async def user_favorites_view(send, engine, args, path, headers):
+    user_id = args.get('user_id')
+    try:
+        user_id = int(user_id) if user_id is not None else None
+    except ValueError:
+        # no user has that id, as in the Flask view
+        return await send_json(send, 200, dumps([]))
+    stmt = select(Favorites).where(Favorites.user_id == user_id).order_by(Favorites.id)
+    expand = args.get('expand', '').lower() in ('1', 'true', 'yes')
+    if expand:
+        stmt = stmt.options(joinedload(Favorites.planet), joinedload(Favorites.people), joinedload(Favorites.vehicle))
+    async with AsyncSession(engine) as session:
+        favorites = (await session.execute(stmt)).scalars().unique().all()
+        data = [favorite.serialize_expanded() if expand else favorite.serialize() for favorite in favorites]
+    await send_json(send, 200, dumps(data))
+
+
+ROUTES = [
+    (re.compile(r'^/people/?$'), list_view(People)),
+    (re.compile(r'^/people/(\d+)/?$'), item_view(People, "Character not found")),
+    (re.compile(r'^/planets/?$'), list_view(Planets)),
+    (re.compile(r'^/planets/(\d+)/?$'), item_view(Planets, "Planet not found")),
+    (re.compile(r'^/vehicles/?$'), list_view(Vehicles)),
+    (re.compile(r'^/vehicles/(\d+)/?$'), item_view(Vehicles, "Vehicle not found")),
+    (re.compile(r'^/users/?$'), list_view(User)),
+    (re.compile(r'^/users/favorites/?$'), user_favorites_view),
+]
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            for replica in replica_engines:
+                await replica.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if scope['method'] == 'GET':
+        for pattern, view in ROUTES:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+            try:
+                headers = dict(scope['headers'])
+                return await view(send, read_engine(scope, args), args, scope['path'], headers, *match.groups())
+            except APIException as error:
+                return await send_json(send, error.status_code, dumps(error.to_dict()))
+            except Exception as e:
+                print(str(e))
+                return await send_json(send, 500, dumps({"message": "Server error"}))
+
+    if flask_asgi is not None:
+        return await flask_asgi(scope, receive, send)
+    await send_json(send, 404, dumps({"message": "Not found"}))
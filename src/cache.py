@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import g, request, make_response, Response
+
+
+class LocalBackend:
+    """In-process LRU with a TTL per entry, the default backend.
+
+    Versions are per process: with several gunicorn workers a write only
+    reaches the other workers' caches when their entries expire. Use
+    CACHE_REDIS_URL there.
+    """
+
+    def __init__(self, max_entries=1024, max_versions=65536):
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        self._entries = OrderedDict()
+        # versions live apart from the entries, evicting one with them would
+        # reset it to 0 and make old entries look fresh again
+        self._versions = OrderedDict()
+        # every key without a version starts here, past any evicted version
+        self._version_floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, table):
+        with self._lock:
+            version = self._versions.get(table)
+            if version is None:
+                return self._version_floor
+            self._versions.move_to_end(table)
+            return version
+
+    def incr_version(self, table):
+        with self._lock:
+            version = self._versions.pop(table, self._version_floor) + 1
+            self._versions[table] = version
+            while len(self._versions) > self.max_versions:
+                _, evicted = self._versions.popitem(last=False)
+                self._version_floor = max(self._version_floor, evicted)
+            return version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._version_floor = 0
+
+
+class RedisBackend:
+    """Shared backend so every gunicorn worker sees the same versions."""
+
+    def __init__(self, url, prefix='swapi:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def get_version(self, table):
+        return int(self.client.get(self.prefix + 'version:' + table) or 0)
+
+    def incr_version(self, table):
+        return self.client.incr(self.prefix + 'version:' + table)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    """Read-through cache of serialized JSON responses.
+
+    Keys embed a per-table version counter, so bumping the version after a
+    write makes every cached response of that table unreachable at once.
+    Only responses read from the primary are stored.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 60
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, backend=None):
+        app.config.setdefault('CACHE_ENABLED', os.getenv('CACHE_ENABLED', '1') not in ('0', 'false'))
+        app.config.setdefault('CACHE_TTL', int(os.getenv('CACHE_TTL', 60)))
+        app.config.setdefault('CACHE_MAX_ENTRIES', int(os.getenv('CACHE_MAX_ENTRIES', 1024)))
+        app.config.setdefault('CACHE_MAX_VERSIONS', int(os.getenv('CACHE_MAX_VERSIONS', 65536)))
+        app.config.setdefault('CACHE_REDIS_URL', os.getenv('CACHE_REDIS_URL'))
+
+        self.enabled = app.config['CACHE_ENABLED']
+        self.ttl = app.config['CACHE_TTL']
+        if backend is not None:
+            self.backend = backend
+        elif app.config['CACHE_REDIS_URL']:
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = LocalBackend(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_MAX_VERSIONS'])
+
+    def bump(self, *tables):
+        for table in tables:
+            self.backend.incr_version(table)
+
+    def _key(self, tables):
+        versions = ','.join('%s=%s' % (table, self.backend.get_version(table)) for table in tables)
+        args = '&'.join('%s=%s' % item for item in sorted(request.args.items(multi=True)))
+        return '%s|%s?%s' % (versions, request.path, args)
+
+    def cached(self, *tables):
+        """Cache successful GET responses of a view that reads ``tables``."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+
+                key = self._key(tables)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    meta, body = entry.split(b'\n', 1)
+                    meta = json.loads(meta)
+                    response = Response(body, mimetype='application/json', headers=meta['headers'])
+                    response.headers['X-Cache'] = 'HIT'
+                    etag = meta['etag']
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    # views may set their own ETag (e.g. a row version), otherwise hash the body
+                    etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+                    if g.get('db_replica') is not None:
+                        # a lagging replica may still have the rows from before the last
+                        # bump, stored under the new version a writer would read them back
+                        response.headers['X-Cache'] = 'BYPASS'
+                    else:
+                        # keep pagination headers such as Link / X-Next-Cursor
+                        headers = {k: v for k, v in response.headers.items() if k not in ('Content-Type', 'Content-Length')}
+                        meta = json.dumps({'etag': etag, 'headers': headers}).encode()
+                        self.backend.set(key, meta + b'\n' + body, self.ttl)
+                        response.headers['X-Cache'] = 'MISS'
+
+                response.set_etag(etag)
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+cache = ResponseCache()
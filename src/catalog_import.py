@@ -0,0 +1,243 @@
+"""
+Bulk import of SWAPI catalog files into people, planets and vehicles, used
+by `flask seed`.
+
+Files are parsed as a stream: JSON arrays (plain records or SWAPI fixtures
+with a "fields" object), NDJSON and CSV with a header row. Rows are upserted
+by name. New names are inserted, existing rows get the file's values and a
+new version, and rows that did not change are left alone.
+
+  * Postgres: every chunk is COPYed into a temporary staging table, one
+    INSERT ... SELECT ... ON CONFLICT merges it at the end (the last row wins
+    when a name repeats). COPY needs psycopg2's copy_expert, other drivers
+    fill the staging table with executemany INSERTs.
+  * SQLite: INSERT ... ON CONFLICT per chunk with executemany, the later
+    row wins as well. The name search index is filled once at the end
+    (search.pause_search_sync) instead of by a trigger per row.
+
+SWAPI writes numbers as text ("1,000,000", "unknown", "1 standard"). Integer
+columns keep the leading number and get NULL when there is none or when it
+does not fit in a 32 bit integer.
+"""
+import io
+import os
+import re
+import csv
+import json
+import time
+from itertools import chain
+from sqlalchemy import Integer, column, func, or_, select, table
+from sqlalchemy.dialects import sqlite
+from models import db
+from utils import iter_text, iter_json_array
+from search import pause_search_sync, resume_search_sync
+
+DEFAULT_CHUNK_SIZE = 10000
+FORMATS = ('json', 'ndjson', 'csv')
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return 'json'
+
+
+def read_records(path, fmt):
+    """Yields the records of a file as dicts, without loading it whole."""
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    elif fmt == 'ndjson':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, 'rb') as f:
+            texts = iter_text(f, 65536)
+            head = ''
+            for text in texts:
+                head += text
+                if head.strip():
+                    break
+            if head.lstrip().startswith('{'):
+                # a single API page: {"count": ..., "results": [...]}
+                yield from json.loads(head + ''.join(texts)).get('results', [])
+            else:
+                yield from iter_json_array(chain([head], texts))
+
+
+def to_int(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = int(value)  # JSON numbers and plain "172", the common case
+    except (TypeError, ValueError, OverflowError):
+        match = NUMBER.match(str(value).replace(',', '').strip())
+        if not match:
+            return None
+        value = int(float(match.group()))
+    return value if INT_MIN <= value <= INT_MAX else None
+
+
+def _row(record, fields, integer_fields):
+    # SWAPI fixtures wrap the columns: {"model": "resources.planet", "pk": 1, "fields": {...}}
+    if isinstance(record.get('fields'), dict):
+        record = record['fields']
+    row = {}
+    for field in fields:
+        value = record.get(field)
+        if value == '':
+            value = None
+        elif field in integer_fields:
+            value = to_int(value)
+        elif value is not None:
+            value = str(value)
+        row[field] = value
+    return row
+
+
+def _sqlite_upsert(model, fields):
+    table = model.__table__
+    stmt = sqlite.insert(table)
+    changed = [field for field in fields if field != 'name']
+    return stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_=dict({field: stmt.excluded[field] for field in changed}, version=table.c.version + 1),
+        where=or_(*[table.c[field].is_distinct_from(stmt.excluded[field]) for field in changed]),
+    )
+
+
+class _PostgresStaging:
+    """COPY into a temporary table, merged into the real one by finish()."""
+
+    def __init__(self, model, fields):
+        self.table = model.__tablename__
+        self.fields = fields
+        self.connection = db.session.connection()
+        columns = ', '.join(fields)
+        self.connection.exec_driver_sql(
+            "CREATE TEMPORARY TABLE seed_staging ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA" % (columns, self.table))
+        # the order rows were read in, the last one wins when a name repeats
+        self.connection.exec_driver_sql("ALTER TABLE seed_staging ADD COLUMN seq bigserial")
+        self.copy = "COPY seed_staging (%s) FROM STDIN WITH (FORMAT csv)" % columns
+        self.insert = table('seed_staging', *[column(field) for field in fields]).insert()
+        # psycopg 3 and pg8000 cursors have no copy_expert
+        self.can_copy = self.connection.dialect.driver == 'psycopg2'
+
+    def write(self, rows):
+        if not self.can_copy:
+            self.connection.execute(self.insert, rows)
+            return
+        buffer = io.StringIO()
+        # csv writes None as an unquoted empty field, which COPY reads as NULL
+        csv.writer(buffer).writerows([row[field] for field in self.fields] for row in rows)
+        buffer.seek(0)
+        with self.connection.connection.cursor() as cursor:
+            cursor.copy_expert(self.copy, buffer)
+
+    def finish(self):
+        columns = ', '.join(self.fields)
+        changed = [field for field in self.fields if field != 'name']
+        inserted, updated = self.connection.exec_driver_sql("""
+            WITH merged AS (
+                INSERT INTO {table} ({columns})
+                SELECT DISTINCT ON (name) {columns} FROM seed_staging ORDER BY name, seq DESC
+                ON CONFLICT (name) DO UPDATE SET {assignments}, version = {table}.version + 1
+                WHERE ({current}) IS DISTINCT FROM ({new})
+                RETURNING xmax = 0 AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+        """.format(
+            table=self.table, columns=columns,
+            assignments=', '.join('%s = EXCLUDED.%s' % (field, field) for field in changed),
+            current=', '.join('%s.%s' % (self.table, field) for field in changed),
+            new=', '.join('EXCLUDED.%s' % field for field in changed),
+        )).one()
+        self.connection.exec_driver_sql("DROP TABLE seed_staging")
+        return inserted, updated
+
+
+class _SQLiteUpsert:
+    def __init__(self, model, fields):
+        self.model = model
+        self.stmt = _sqlite_upsert(model, fields)
+        self.count_before = self._count()
+        self.written = 0
+        self.paused = False
+        self.search_after_id = None
+
+    def _count(self):
+        return db.session.execute(select(func.count()).select_from(self.model.__table__)).scalar()
+
+    def write(self, rows):
+        self.written += db.session.execute(self.stmt, rows).rowcount
+        if not self.paused:
+            # the per row FTS trigger would cost more than the upsert itself
+            self.paused = True
+            self.search_after_id = pause_search_sync(self.model)
+
+    def finish(self):
+        if self.search_after_id is not None:
+            resume_search_sync(self.model, self.search_after_id)
+        inserted = self._count() - self.count_before
+        return inserted, self.written - inserted
+
+
+def import_records(model, records, fields, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Upserts records into model by name, in the caller's transaction.
+
+    Returns (inserted, updated, skipped), records without a name are skipped.
+    progress(rows read) is called after every chunk.
+    """
+    integer_fields = {field for field in fields if isinstance(model.__table__.c[field].type, Integer)}
+    if db.session.get_bind().dialect.name == 'postgresql':
+        writer = _PostgresStaging(model, fields)
+    else:
+        writer = _SQLiteUpsert(model, fields)
+
+    read, skipped, chunk = 0, 0, []
+    for record in records:
+        read += 1
+        row = _row(record, fields, integer_fields) if isinstance(record, dict) else None
+        if row is None or row['name'] is None:
+            skipped += 1
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            writer.write(chunk)
+            chunk = []
+            if progress is not None:
+                progress(read)
+    if chunk:
+        writer.write(chunk)
+    if progress is not None:
+        progress(read)
+    inserted, updated = writer.finish()
+    return inserted, updated, skipped
+
+
+class Progress:
+    """Prints rows read and rows per second, at most once per interval."""
+
+    def __init__(self, label, interval=1.0):
+        self.label = label
+        self.interval = interval
+        self.start = self.last = time.perf_counter()
+        self.rows = 0
+
+    def __call__(self, rows):
+        self.rows = rows
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            print("%s: %d rows read, %.0f rows/s" % (self.label, rows, rows / (now - self.start)))
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return elapsed, self.rows / elapsed if elapsed else 0.0
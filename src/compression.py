@@ -0,0 +1,118 @@
+import os
+import zlib
+import importlib.util
+from flask import request
+
+# optional, only gzip is offered without it. Imported on the first brotli
+# response, a worker that never sends one does not pay for the import.
+HAS_BROTLI = importlib.util.find_spec('brotli') is not None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html')
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 31: zlib stream with a gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality):
+        import brotli
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compression:
+    """gzip / brotli response compression negotiated with Accept-Encoding.
+
+    Bodies smaller than COMPRESS_MIN_SIZE go out as they are, the framing
+    overhead would outweigh the gain. Streamed responses are compressed
+    chunk by chunk as the view yields them, they are never buffered.
+    COMPRESS_LEVEL (gzip, 1-9) and COMPRESS_BROTLI_QUALITY (0-11) trade CPU
+    for size.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.min_size = 1024
+        self.level = 6
+        self.brotli_quality = 4
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', os.getenv('COMPRESS_ENABLED', '1') not in ('0', 'false'))
+        app.config.setdefault('COMPRESS_MIN_SIZE', int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+        app.config.setdefault('COMPRESS_LEVEL', int(os.getenv('COMPRESS_LEVEL', 6)))
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.getenv('COMPRESS_BROTLI_QUALITY', 4)))
+
+        self.enabled = app.config['COMPRESS_ENABLED']
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        if self.enabled:
+            app.after_request(self._after_request)
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return _Brotli(self.brotli_quality)
+        return _Gzip(self.level)
+
+    def _encoding(self):
+        offered = ['br', 'gzip'] if HAS_BROTLI else ['gzip']
+        # ties go to the first offered encoding, brotli compresses JSON better
+        return request.accept_encodings.best_match(offered)
+
+    def _after_request(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not 200 <= response.status_code < 300 or response.status_code == 204 or request.method == 'HEAD':
+            return response
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.response, self._compressor(encoding))
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            compressor = self._compressor(encoding)
+            response.set_data(compressor.process(body) + compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        # the compressed bytes are a different representation of the same content
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, compressor):
+        try:
+            for chunk in chunks:
+                data = compressor.process(chunk.encode() if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+compression = Compression()
@@ -0,0 +1,74 @@
+"""
+Full table exports for analytics, served by GET /export/<table>.
+
+Rows are read in id order through a server-side cursor (yield_per, which
+turns on stream_results) and written out one batch at a time, so memory stays
+flat whatever the table size. A client that lost the connection resumes
+with ?after_id=<last id it received>. Only a model's export_fields are
+read, User.password is not one of them.
+"""
+import io
+import csv
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select
+from models import db, User, People, Planets, Vehicles, Favorites
+from utils import APIException
+
+EXPORT_MODELS = {
+    'users': User,
+    'people': People,
+    'planets': Planets,
+    'vehicles': Vehicles,
+    'favorites': Favorites,
+}
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_statement(model, after_id=None):
+    stmt = select(*[getattr(model, name) for name in model.export_fields]).order_by(model.id)
+    if after_id is not None:
+        stmt = stmt.where(model.id > after_id)
+    return stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def _ndjson_batches(partitions, fields):
+    dumps = current_app.json.dumps
+    for rows in partitions:
+        yield ''.join(dumps(dict(zip(fields, row))) + '\n' for row in rows)
+
+
+def _csv_batches(partitions, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # only the header, the table is empty
+
+
+def export_response(table, fmt='ndjson', after_id=None):
+    model = EXPORT_MODELS.get(table)
+    if model is None:
+        raise APIException("Unknown table: %s" % table, status_code=404)
+    if fmt not in EXPORT_FORMATS:
+        raise APIException("format must be one of: %s" % ", ".join(EXPORT_FORMATS), status_code=400)
+    if after_id is not None:
+        try:
+            after_id = int(after_id)
+        except ValueError:
+            raise APIException("after_id must be an integer", status_code=400)
+
+    fields = list(model.export_fields)
+    partitions = db.session.execute(export_statement(model, after_id)).partitions()
+    batches = _csv_batches(partitions, fields) if fmt == 'csv' else _ndjson_batches(partitions, fields)
+    response = Response(stream_with_context(batches), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' % (table, fmt)
+    return response
@@ -0,0 +1,166 @@
+"""
+In-process membership index of users' favorites, behind
+GET /users/<id>/favorites/contains.
+
+A user's favorites are kept as one sorted array('i') of ids per kind (4
+bytes per favorite), so "is X a favorite" is a bisect and asking about a
+page of 50 ids takes microseconds. Entries are loaded on first use with one
+index-only scan of ix_favorites_user_entity on the primary, patched by the favorite
+handlers after they commit, and evicted least recently used past
+FAVORITES_INDEX_MAX_BYTES.
+
+Every write bumps a per-user version in the cache backend, an entry built
+at an older version is rebuilt. With Redis that covers writes made by other
+workers, with the local backend FAVORITES_INDEX_TTL bounds how long
+another worker's write can go unseen. Favorites removed by a delete trigger
+(their planet, person or vehicle was deleted) are also only dropped by the
+TTL, the ids they answer for no longer exist.
+"""
+import os
+import sys
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from flask import g, has_app_context
+from sqlalchemy import select
+from models import db, Favorites, FAVORITE_KINDS
+
+# the OrderedDict slot, the entry object and its dict of arrays
+ENTRY_OVERHEAD = 400
+
+
+def _contains(ids, entity_id):
+    position = bisect_left(ids, entity_id)
+    return position < len(ids) and ids[position] == entity_id
+
+
+class _Entry:
+    __slots__ = ('ids', 'version', 'expires_at', 'size')
+
+    def __init__(self, ids, version, expires_at):
+        self.ids = ids
+        self.version = version
+        self.expires_at = expires_at
+        self.size = self.measure()
+
+    def measure(self):
+        return ENTRY_OVERHEAD + sum(sys.getsizeof(kind_ids) for kind_ids in self.ids.values())
+
+
+class FavoritesIndex:
+    def __init__(self, app=None):
+        self.max_bytes = 32 * 1024 * 1024
+        self.ttl = 300
+        self.store = None
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, store=None):
+        app.config.setdefault('FAVORITES_INDEX_MAX_BYTES', int(os.getenv('FAVORITES_INDEX_MAX_BYTES', 32 * 1024 * 1024)))
+        app.config.setdefault('FAVORITES_INDEX_TTL', float(os.getenv('FAVORITES_INDEX_TTL', 300)))
+        self.max_bytes = app.config['FAVORITES_INDEX_MAX_BYTES']
+        self.ttl = app.config['FAVORITES_INDEX_TTL']
+        self.store = store
+
+    def _version_key(self, user_id):
+        return 'favorites:user:%s' % user_id
+
+    def _version(self, user_id):
+        return self.store.get_version(self._version_key(user_id)) if self.store is not None else 0
+
+    def _load(self, user_id):
+        # entity_type, entity_id order is the index order, the arrays come out sorted
+        stmt = (select(Favorites.entity_type, Favorites.entity_id)
+                .where(Favorites.user_id == user_id)
+                .order_by(Favorites.entity_type, Favorites.entity_id))
+        ids = {kind: array('i') for kind in FAVORITE_KINDS}
+        for kind, entity_id in db.session.execute(stmt):
+            ids[kind].append(entity_id)
+        return ids
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+
+    def _drop(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def get(self, user_id):
+        """The user's favorite ids, {kind: sorted array}, loaded if needed."""
+        user_id = int(user_id)
+        version = self._version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.version == version and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                return entry.ids
+
+        # read outside the lock, a write committed meanwhile bumps the version past this one
+        entry = _Entry(self._load(user_id), version, time.monotonic() + self.ttl)
+        if has_app_context() and g.get('db_replica') is not None:
+            # a replica may miss the write that bumped the version, never keep what it returned
+            return entry.ids
+        with self._lock:
+            self._drop(user_id)
+            if entry.size <= self.max_bytes:
+                self._entries[user_id] = entry
+                self.size += entry.size
+                self._evict()
+        return entry.ids
+
+    def contains(self, user_id, ids_by_kind):
+        """{kind: [the ids that are favorites]} for {kind: [ids]}."""
+        favorites = self.get(user_id)
+        return {kind: [entity_id for entity_id in ids if _contains(favorites[kind], entity_id)]
+                for kind, ids in ids_by_kind.items()}
+
+    def update(self, user_id, kind, added=(), removed=()):
+        """Applies a committed write to the user's entry, if it is loaded."""
+        user_id = int(user_id)
+        version = self.store.incr_version(self._version_key(user_id)) if self.store is not None else 0
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if self.store is not None and entry.version != version - 1:
+                # another write went in between, this entry missed it
+                self._drop(user_id)
+                return
+            ids = entry.ids[kind]
+            for entity_id in added:
+                position = bisect_left(ids, entity_id)
+                if position == len(ids) or ids[position] != entity_id:
+                    ids.insert(position, entity_id)
+            for entity_id in removed:
+                position = bisect_left(ids, entity_id)
+                if position < len(ids) and ids[position] == entity_id:
+                    del ids[position]
+            entry.version = version
+            size = entry.measure()
+            self.size += size - entry.size
+            entry.size = size
+            self._evict()
+
+    def invalidate(self, user_id):
+        """For writes that bypass update(): the entry is loaded again on next use."""
+        user_id = int(user_id)
+        if self.store is not None:
+            self.store.incr_version(self._version_key(user_id))
+        with self._lock:
+            self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+favorites_index = FavoritesIndex()
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import atexit
+import threading
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('Response body size', SIZE_BUCKETS),
+    'db_statements_per_request': ('SQL statements executed per request', QUERY_BUCKETS),
+    'db_time_per_request_seconds': ('Time spent in SQL per request', LATENCY_BUCKETS),
+}
+COUNTERS = {
+    'http_requests_total': 'Requests by endpoint and status',
+    'db_statements_total': 'SQL statements executed',
+    'db_time_seconds_total': 'Time spent in SQL',
+}
+
+
+class Registry:
+    """Counters and histograms of one process, stored as plain dicts so they
+    can be dumped to JSON and summed with the other workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            hist['buckets'][bisect_left(buckets, value)] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def dump(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), hist] for (name, labels), hist in self.histograms.items()],
+            }
+
+    def merge(self, data):
+        for name, labels, value in data['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+        for name, labels, hist in data['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = self.histograms.setdefault(key, {'buckets': [0] * len(hist['buckets']), 'sum': 0.0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], hist['buckets'])]
+            total['sum'] += hist['sum']
+            total['count'] += hist['count']
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return '%s %s' % (name, value)
+    text = ','.join('%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"')) for key, val in labels)
+    return '%s{%s} %s' % (name, text, value)
+
+
+def render(registry):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for (metric, labels), value in sorted(registry.counters.items()):
+            if metric == name:
+                lines.append(_sample(name, labels, value))
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for (metric, labels), hist in sorted(registry.histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], hist['buckets']):
+                cumulative += count
+                lines.append(_sample(name + '_bucket', labels + (('le', bound),), cumulative))
+            lines.append(_sample(name + '_sum', labels, hist['sum']))
+            lines.append(_sample(name + '_count', labels, hist['count']))
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Request and SQL instrumentation.
+
+    Every process keeps its own registry. With METRICS_MULTIPROC_DIR set, each
+    worker also writes its registry to <dir>/<pid>.json (at most once per
+    METRICS_FLUSH_INTERVAL seconds and at exit) and /metrics sums all of them,
+    so any gunicorn worker answers with the numbers of the whole server.
+    """
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.multiproc_dir = None
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.multiproc_dir = os.getenv('METRICS_MULTIPROC_DIR')
+        self.flush_interval = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+        if self.multiproc_dir:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        # listening on the Engine class covers every engine, replicas included
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.db_statements = 0
+        g.db_time = 0.0
+
+    def _after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('endpoint', endpoint))
+        registry = self.registry
+        registry.inc('http_requests_total', labels + (('status', response.status_code),))
+        registry.observe('http_request_duration_seconds', labels, time.perf_counter() - start)
+        registry.observe('db_statements_per_request', labels, g.db_statements)
+        registry.observe('db_time_per_request_seconds', labels, g.db_time)
+        # calculate_content_length() would buffer a streamed body to measure it
+        if not response.is_streamed:
+            registry.observe('http_response_size_bytes', labels, response.calculate_content_length())
+        if self.multiproc_dir and time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record(time.perf_counter() - conn.info['metrics_query_start'].pop())
+
+    def _handle_error(self, context):
+        # a failed statement never reaches after_cursor_execute, its start time
+        # would stay on the pooled connection and skew every later timing
+        if context.connection is None or context.execution_context is None:
+            return
+        starts = context.connection.info.get('metrics_query_start')
+        if starts:
+            self._record(time.perf_counter() - starts.pop())
+
+    def _record(self, elapsed):
+        self.registry.inc('db_statements_total', ())
+        self.registry.inc('db_time_seconds_total', (), elapsed)
+        if has_request_context() and 'db_statements' in g:
+            g.db_statements += 1
+            g.db_time += elapsed
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        path = os.path.join(self.multiproc_dir, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.registry.dump(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        if not self.multiproc_dir:
+            return render(self.registry)
+        self.flush()
+        total = Registry()
+        for name in os.listdir(self.multiproc_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, name)) as f:
+                    total.merge(json.load(f))
+            except (OSError, ValueError):
+                continue  # a worker is replacing its file right now
+        return render(total)
+
+
+metrics = Metrics()
@@ -1,6 +1,22 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.engine import Engine
+from sqlalchemy import insert, update, delete, select, literal, func
+from sqlalchemy.dialects import postgresql, sqlite
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys (and ON DELETE CASCADE) unless asked to
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
-db = SQLAlchemy()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,6 +27,14 @@ class User(db.Model):
     last_name = db.Column(db.String(80), unique=False, nullable=False)
     username = db.Column(db.String(80), unique=True, nullable=False)
 
+    # columns returned by serialize(), used to query lists as plain tuples
+    serialize_fields = ("id", "email", "username", "first_name", "last_name")
+    # whitelists for ?<field>__<op>= filters and ?sort=, every one is backed by an index
+    filter_fields = ("username",)
+    sort_fields = ("id", "username")
+    # columns /export/<table> may stream, an allowlist so the password never leaves
+    export_fields = ("id", "email", "username", "first_name", "last_name", "is_active")
+
     def __repr__(self):
         return '<User %r>' % self.id
 
@@ -25,12 +49,30 @@ class User(db.Model):
         }
 
 class People(db.Model):
+    __table_args__ = (
+        db.Index('ix_people_gender', 'gender', 'id'),
+        db.Index('ix_people_eye_color', 'eye_color', 'id'),
+        db.Index('ix_people_height', 'height', 'id'),
+        db.Index('ix_people_favorites_count', 'favorites_count', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     eye_color = db.Column(db.String(80), unique=False, nullable=True)
     height = db.Column(db.Integer, unique=False, nullable=True)
     skin_color = db.Column(db.String(120), unique=False, nullable=True)
     gender = db.Column(db.String(120), unique=False, nullable=True)
+    # how many Favorites point here, kept up to date by Favorites.add/remove
+    favorites_count = db.Column(db.Integer, nullable=False, server_default='0', default=0)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    # optimistic locking: every ORM update bumps version and checks the old one
+    __mapper_args__ = {"version_id_col": version}
+
+    serialize_fields = ("id", "name", "eye_color", "height", "skin_color", "gender")
+    filter_fields = ("name", "gender", "eye_color", "height")
+    sort_fields = ("id", "name", "height")
+    export_fields = serialize_fields + ("favorites_count",)
 
     def __repr__(self):
         return '<People %r>' % self.id
@@ -46,12 +88,28 @@ class People(db.Model):
         }
 
 class Planets(db.Model):
+    __table_args__ = (
+        db.Index('ix_planets_climate', 'climate', 'id'),
+        db.Index('ix_planets_population', 'population', 'id'),
+        db.Index('ix_planets_diameter', 'diameter', 'id'),
+        db.Index('ix_planets_favorites_count', 'favorites_count', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     gravity = db.Column(db.Integer, unique=False, nullable=True)
     population = db.Column(db.Integer, unique=False, nullable=True)
     climate = db.Column(db.String(80), unique=False, nullable=True)
     diameter = db.Column(db.Integer, unique=False, nullable=True)    
+    favorites_count = db.Column(db.Integer, nullable=False, server_default='0', default=0)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {"version_id_col": version}
+
+    serialize_fields = ("id", "name", "gravity", "population", "climate", "diameter")
+    filter_fields = ("name", "climate", "population", "diameter")
+    sort_fields = ("id", "name", "population", "diameter")
+    export_fields = serialize_fields + ("favorites_count",)
 
     def __repr__(self):
         return '<Planets %r>' % self.id
@@ -67,6 +125,13 @@ class Planets(db.Model):
         }
 
 class Vehicles(db.Model):
+    __table_args__ = (
+        db.Index('ix_vehicles_model', 'model', 'id'),
+        db.Index('ix_vehicles_passengers', 'passengers', 'id'),
+        db.Index('ix_vehicles_cost_in_credits', 'cost_in_credits', 'id'),
+        db.Index('ix_vehicles_favorites_count', 'favorites_count', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     model = db.Column(db.String(80), unique=False, nullable=True)
@@ -74,6 +139,15 @@ class Vehicles(db.Model):
     cost_in_credits = db.Column(db.Integer, unique=False, nullable=True)
     crew = db.Column(db.Integer, unique=False, nullable=True)
     length = db.Column(db.Integer, unique=False, nullable=True)    
+    favorites_count = db.Column(db.Integer, nullable=False, server_default='0', default=0)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {"version_id_col": version}
+
+    serialize_fields = ("id", "name", "model", "passengers", "cost_in_credits", "crew", "length")
+    filter_fields = ("name", "model", "passengers", "cost_in_credits")
+    sort_fields = ("id", "name", "passengers", "cost_in_credits")
+    export_fields = serialize_fields + ("favorites_count",)
 
     def __repr__(self):
         return '<Vehicles %r>' % self.id
@@ -90,22 +164,54 @@ class Vehicles(db.Model):
           }
 
 class Favorites(db.Model):
+    __table_args__ = (
+        # every read is "favorites of user X", served from this index alone
+        # (Postgres INCLUDEs id, SQLite indexes carry the rowid anyway)
+        db.Index('ix_favorites_user_entity', 'user_id', 'entity_type', 'entity_id', unique=True,
+                 postgresql_include=['id']),
+        # the cascade triggers look favorites up by the entity
+        db.Index('ix_favorites_entity', 'entity_type', 'entity_id'),
+        db.CheckConstraint("entity_type IN ('planet', 'people', 'vehicle')", name='ck_favorites_entity_type'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True)
-    people_id = db.Column(db.Integer, db.ForeignKey('people.id'), nullable=True)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=True)
-    
+    # a FAVORITE_KINDS key, entity_id is the id in that kind's table
+    entity_type = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+
     # Relaciones
     user = db.relationship('User', backref=db.backref('favorites', lazy=True))
-    planet = db.relationship('Planets', backref=db.backref('favorites', lazy=True))
-    people = db.relationship('People', backref=db.backref('favorites', lazy=True))
-    vehicle = db.relationship('Vehicles', backref=db.backref('favorites', lazy=True))
+    # read only, favorites are written with Core statements by the methods below
+    planet = db.relationship('Planets', viewonly=True,
+                             primaryjoin="and_(Favorites.entity_type == 'planet', foreign(Favorites.entity_id) == Planets.id)")
+    people = db.relationship('People', viewonly=True,
+                             primaryjoin="and_(Favorites.entity_type == 'people', foreign(Favorites.entity_id) == People.id)")
+    vehicle = db.relationship('Vehicles', viewonly=True,
+                              primaryjoin="and_(Favorites.entity_type == 'vehicle', foreign(Favorites.entity_id) == Vehicles.id)")
+
+    export_fields = ("id", "user_id", "entity_type", "entity_id")
 
     def __repr__(self):
         return '<Favorites %r>' % self.id
 
+    def _entity_id(self, kind):
+        return self.entity_id if self.entity_type == kind else None
+
+    @property
+    def planet_id(self):
+        return self._entity_id('planet')
+
+    @property
+    def people_id(self):
+        return self._entity_id('people')
+
+    @property
+    def vehicle_id(self):
+        return self._entity_id('vehicle')
+
     def serialize(self):
+        # the shape of the old one column per kind layout
         return {
             "id": self.id,
             "user_id": self.user_id,  
@@ -113,3 +219,173 @@ class Favorites(db.Model):
             "planet_id": self.planet_id, 
             "vehicle_id": self.vehicle_id
         }
+
+    def serialize_expanded(self):
+        # relationships must be eager loaded by the caller to avoid N+1 queries
+        data = self.serialize()
+        data["planet"] = self.planet.serialize() if self.planet else None
+        data["people"] = self.people.serialize() if self.people else None
+        data["vehicle"] = self.vehicle.serialize() if self.vehicle else None
+        return data
+
+    @classmethod
+    def _insert_ignore(cls):
+        # INSERT that turns a (user_id, entity_type, entity_id) duplicate into a no-op
+        dialect = db.session.get_bind().dialect.name
+        index_elements = ['user_id', 'entity_type', 'entity_id']
+        if dialect == 'postgresql':
+            return postgresql.insert(cls).on_conflict_do_nothing(index_elements=index_elements)
+        if dialect == 'sqlite':
+            return sqlite.insert(cls).on_conflict_do_nothing(index_elements=index_elements)
+        return insert(cls).prefix_with('IGNORE')
+
+    @classmethod
+    def _adjust_counts(cls, kind, entity_ids, delta):
+        # runs in the caller's transaction, so the counter commits with the favorite
+        if not entity_ids:
+            return
+        model = FAVORITE_KINDS[kind]
+        stmt = (update(model).where(model.id.in_(entity_ids))
+                .values(favorites_count=model.favorites_count + delta)
+                .execution_options(synchronize_session=False))
+        db.session.execute(stmt)
+
+    @classmethod
+    def _counted_statement(cls, kind, write, delta):
+        """WITH changed AS (<write> RETURNING entity_id) UPDATE <kind table>
+        ... RETURNING id, for Postgres: the favorites and their counters in
+        one statement. Every favorite points at an existing row (the delete
+        triggers see to it), so the ids returned are the favorites written."""
+        model = FAVORITE_KINDS[kind]
+        changed = write.returning(cls.entity_id).cte('changed')
+        return (update(model).where(model.id.in_(select(changed.c.entity_id)))
+                .values(favorites_count=model.favorites_count + delta)
+                .returning(model.id)
+                .execution_options(synchronize_session=False))
+
+    @classmethod
+    def _execute_counted(cls, kind, write, delta):
+        # returns the entity ids written; SQLite has no writes in WITH, it
+        # runs the counter UPDATE as a second statement in the same transaction
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return [row[0] for row in db.session.execute(cls._counted_statement(kind, write, delta))]
+        return None
+
+    @classmethod
+    def add(cls, user_id, kind, entity_id):
+        # INSERT ... SELECT only inserts when the entity exists and the unique
+        # index turns a duplicate into a no-op, so a single statement does it all.
+        # Returns the number of inserted rows (0 or 1).
+        model = FAVORITE_KINDS[kind]
+        source = select(literal(user_id, db.Integer), literal(kind), model.id).where(model.id == entity_id)
+        stmt = cls._insert_ignore().from_select(['user_id', 'entity_type', 'entity_id'], source)
+        written = cls._execute_counted(kind, stmt, 1)
+        if written is not None:
+            return len(written)
+        inserted = db.session.execute(stmt).rowcount
+        if inserted:
+            cls._adjust_counts(kind, [entity_id], 1)
+        return inserted
+
+    @classmethod
+    def add_many(cls, user_id, kind, entity_ids):
+        if not entity_ids:
+            return
+        rows = [{'user_id': user_id, 'entity_type': kind, 'entity_id': entity_id} for entity_id in entity_ids]
+        # on Postgres a concurrent request may have inserted some of them, only ours are counted
+        if cls._execute_counted(kind, cls._insert_ignore().values(rows), 1) is None:
+            db.session.execute(cls._insert_ignore(), rows)
+            cls._adjust_counts(kind, entity_ids, 1)
+
+    @classmethod
+    def remove(cls, user_id, kind, entity_id):
+        stmt = delete(cls).where(cls.user_id == user_id, cls.entity_type == kind, cls.entity_id == entity_id)
+        written = cls._execute_counted(kind, stmt, -1)
+        if written is not None:
+            return len(written)
+        deleted = db.session.execute(stmt).rowcount
+        if deleted:
+            cls._adjust_counts(kind, [entity_id], -1)
+        return deleted
+
+    @classmethod
+    def remove_many(cls, user_id, kind, entity_ids):
+        if not entity_ids:
+            return 0
+        stmt = delete(cls).where(cls.user_id == user_id, cls.entity_type == kind, cls.entity_id.in_(entity_ids))
+        written = cls._execute_counted(kind, stmt, -1)
+        if written is not None:
+            return len(written)
+        deleted = db.session.execute(stmt).rowcount
+        cls._adjust_counts(kind, entity_ids, -1)
+        return deleted
+
+    @classmethod
+    def existing_ids(cls, user_id, kind, entity_ids):
+        if not entity_ids:
+            return set()
+        rows = db.session.execute(select(cls.entity_id).where(
+            cls.user_id == user_id, cls.entity_type == kind, cls.entity_id.in_(entity_ids)))
+        return {row[0] for row in rows}
+
+    @classmethod
+    def user_ids_of(cls, kind, entity_ids):
+        # served by ix_favorites_entity, the users whose favorites a delete trigger will remove
+        rows = db.session.execute(select(cls.user_id).distinct().where(
+            cls.entity_type == kind, cls.entity_id.in_(entity_ids)))
+        return [row[0] for row in rows]
+
+
+# kind used in the API and stored in Favorites.entity_type -> model
+FAVORITE_KINDS = {
+    'planet': Planets,
+    'people': People,
+    'vehicle': Vehicles,
+}
+FAVORITE_KIND_OF = {model: kind for kind, model in FAVORITE_KINDS.items()}
+
+
+def reconcile_favorite_counts():
+    """Recomputes favorites_count from the Favorites table.
+
+    Repairs counters after writes that bypass Favorites.add/remove (raw SQL,
+    deleted users, imports). Returns the number of corrected rows per table.
+    """
+    fixed = {}
+    for kind, model in FAVORITE_KINDS.items():
+        actual = (select(func.count(Favorites.id))
+                  .where(Favorites.entity_type == kind, Favorites.entity_id == model.id)
+                  .scalar_subquery())
+        stmt = (update(model).where(model.favorites_count != actual)
+                .values(favorites_count=actual)
+                .execution_options(synchronize_session=False))
+        fixed[model.__tablename__] = db.session.execute(stmt).rowcount
+    return fixed
+
+
+# entity_id can't reference three tables, triggers stand in for ON DELETE CASCADE
+FAVORITES_SQLITE_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS {table}_favorites_delete AFTER DELETE ON {table} BEGIN "
+    "DELETE FROM favorites WHERE entity_type = '{kind}' AND entity_id = old.id; END",
+]
+# one DELETE on favorites per statement, however many rows the statement removed
+FAVORITES_POSTGRES_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION favorites_cascade() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "DELETE FROM favorites f USING deleted d WHERE f.entity_type = TG_ARGV[0] AND f.entity_id = d.id; "
+    "RETURN NULL; END $$")
+FAVORITES_POSTGRES_DDL = [
+    "DROP TRIGGER IF EXISTS {table}_favorites_delete ON {table}",
+    "CREATE TRIGGER {table}_favorites_delete AFTER DELETE ON {table} REFERENCING OLD TABLE AS deleted "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE favorites_cascade('{kind}')",
+]
+
+# on the metadata: the triggers need both their table and favorites to exist
+event.listen(db.metadata, 'after_create', DDL(FAVORITES_POSTGRES_FUNCTION).execute_if(dialect='postgresql'))
+for _kind, _model in FAVORITE_KINDS.items():
+    for _statement in FAVORITES_SQLITE_DDL:
+        event.listen(db.metadata, 'after_create',
+                     DDL(_statement.format(table=_model.__tablename__, kind=_kind)).execute_if(dialect='sqlite'))
+    for _statement in FAVORITES_POSTGRES_DDL:
+        event.listen(db.metadata, 'after_create',
+                     DDL(_statement.format(table=_model.__tablename__, kind=_kind)).execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'after_drop', DDL("DROP FUNCTION IF EXISTS favorites_cascade()").execute_if(dialect='postgresql'))
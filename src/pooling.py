@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that also records how long checkouts waited for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        # QueuePool._do_get calls itself again in some paths, only time the outer call
+        if getattr(self._local, 'timing', False):
+            return super()._do_get()
+        self._local.timing = True
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._local.timing = False
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def engine_options_from_env(database_url):
+    """Builds SQLALCHEMY_ENGINE_OPTIONS from DB_* environment variables.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a
+    connection), DB_POOL_RECYCLE (seconds), DB_POOL_PRE_PING (1/0) and
+    DB_STATEMENT_TIMEOUT (milliseconds, Postgres only).
+    """
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') not in ('0', 'false'),
+    }
+    if database_url.startswith('sqlite'):
+        # sqlite uses its own pools without size or overflow
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=_env_int('DB_POOL_SIZE', 5),
+        max_overflow=_env_int('DB_MAX_OVERFLOW', 10),
+        pool_timeout=_env_int('DB_POOL_TIMEOUT', 30),
+        # Render closes idle connections, recycle them before that happens
+        pool_recycle=_env_int('DB_POOL_RECYCLE', 300),
+    )
+    statement_timeout = _env_int('DB_STATEMENT_TIMEOUT', 0)
+    if statement_timeout and database_url.startswith('postgresql'):
+        options['connect_args'] = {'options': '-c statement_timeout=%d' % statement_timeout}
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_total_ms": round(pool.wait_total * 1000, 3),
+            "wait_avg_ms": round(pool.wait_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+            "wait_max_ms": round(pool.wait_max * 1000, 3),
+        })
+    return stats
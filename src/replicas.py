@@ -0,0 +1,102 @@
+import os
+import time
+import random
+from functools import wraps
+from flask import g, request, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from pooling import engine_options_from_env
+
+STICKY_COOKIE = 'read_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(Session):
+    """Session that sends the statements of read-only views to a replica.
+
+    ReplicaRouter.read_only stores the chosen replica engine in g for the
+    request, everything else (and any flush) uses the regular binds.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """Routes read-only views to DATABASE_REPLICA_URLS.
+
+    After a successful write the client reads from the primary for
+    DB_REPLICA_STICKY_SECONDS, so it never misses its own write because of
+    replication lag. The window is tracked with a cookie and, for requests
+    that carry a user_id, in the cache backend (shared by every worker when
+    it is Redis).
+    """
+
+    def __init__(self, app=None):
+        self.urls = []
+        self.engines = []
+        self.sticky_seconds = 5
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, store=None):
+        app.config.setdefault('DATABASE_REPLICA_URLS', os.getenv('DATABASE_REPLICA_URLS', ''))
+        app.config.setdefault('DB_REPLICA_STICKY_SECONDS', float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5)))
+
+        self.urls = [url.strip().replace('postgres://', 'postgresql://', 1)
+                     for url in app.config['DATABASE_REPLICA_URLS'].split(',') if url.strip()]
+        self.engines = [create_engine(url, **engine_options_from_env(url)) for url in self.urls]
+        self.sticky_seconds = app.config['DB_REPLICA_STICKY_SECONDS']
+        self.store = store
+        if self.engines:
+            app.after_request(self._after_request)
+
+    def _user_key(self, user_id):
+        return 'primary:user:%s' % user_id
+
+    def _request_user_id(self):
+        user_id = request.args.get('user_id')
+        if user_id is None and request.view_args:
+            user_id = request.view_args.get('user_id')
+        return user_id
+
+    def is_sticky(self, cookie_value=None, user_id=None):
+        try:
+            if cookie_value and float(cookie_value) > time.time():
+                return True
+        except ValueError:
+            pass
+        return user_id is not None and self.store is not None and self.store.get(self._user_key(user_id)) is not None
+
+    def pick(self, cookie_value=None, user_id=None):
+        """Index of the replica to read from, or None for the primary."""
+        if not self.engines or self.is_sticky(cookie_value, user_id):
+            return None
+        return random.randrange(len(self.engines))
+
+    def read_only(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            index = self.pick(request.cookies.get(STICKY_COOKIE), self._request_user_id())
+            if index is not None:
+                g.db_replica = self.engines[index]
+            return view(*args, **kwargs)
+        return wrapper
+
+    def _after_request(self, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return response
+        until = time.time() + self.sticky_seconds
+        response.set_cookie(STICKY_COOKIE, '%.3f' % until, max_age=max(int(self.sticky_seconds), 1), httponly=True)
+        user_id = self._request_user_id()
+        if user_id is not None and self.store is not None:
+            self.store.set(self._user_key(user_id), b'1', self.sticky_seconds)
+        return response
+
+
+replicas = ReplicaRouter()
@@ -0,0 +1,191 @@
+"""
+Name search across people, planets and vehicles.
+
+Results come in two tiers: names starting with the query (case-insensitive,
+alphabetical), then names that only contain it (by id). Every tier is read
+per table from an index in index order with a LIMIT, and the three tables
+are merged here, so a page costs a few index range scans.
+
+  * prefix: btree on lower(name) COLLATE "C" (Postgres) or on
+    name COLLATE NOCASE (SQLite), scanned as a [q, q + U+10FFFF) range.
+  * substring: pg_trgm GIN index on name (Postgres) or an FTS5 trigram
+    table <table>_search kept in sync by triggers (SQLite). Trigram indexes
+    need at least 3 characters, shorter queries only match prefixes.
+
+The indexes are created by the migration and, for create_all() databases,
+by the DDL listeners at the bottom of this module.
+"""
+import string
+from sqlalchemy import DDL, event, func, or_, and_, select, text
+from models import db, People, Planets, Vehicles
+from utils import APIException, encode_cursor, decode_cursor
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MIN_SUBSTRING_LENGTH = 3
+PREFIX_END = '\U0010ffff'  # sorts after every character, closes the prefix range
+# NOCASE only folds ASCII letters
+ASCII_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# the position in this list breaks ties between kinds
+SEARCH_KINDS = [('people', People), ('planet', Planets), ('vehicle', Vehicles)]
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def fold_case(value, dialect):
+    # the same case folding the prefix index uses, in Python
+    return value.lower() if dialect == 'postgresql' else value.translate(ASCII_FOLD)
+
+
+def prefix_key(model, dialect):
+    if dialect == 'postgresql':
+        return func.lower(model.name).collate('C')
+    return model.name.collate('NOCASE')
+
+
+def _prefix_matches(q, limit, after, dialect):
+    low = fold_case(q, dialect)
+    rows = []
+    for code, (kind, model) in enumerate(SEARCH_KINDS):
+        key = prefix_key(model, dialect)
+        stmt = select(key, model.id, model.name).where(key >= low, key < low + PREFIX_END)
+        if after is not None:
+            # (key, kind, id) > (after_key, after_kind, after_id) for a fixed kind
+            after_key, after_code, after_id = after
+            if code > after_code:
+                tie = key >= after_key
+            elif code == after_code:
+                tie = or_(key > after_key, and_(key == after_key, model.id > after_id))
+            else:
+                tie = key > after_key
+            stmt = stmt.where(tie)
+        stmt = stmt.order_by(key, model.id).limit(limit)
+        rows += [(fold_case(row[0], dialect), code, row[1], row[2]) for row in db.session.execute(stmt)]
+    rows.sort(key=lambda row: (row[0], row[1], row[2]))
+    return [(0, sort_key, code, entity_id, name) for sort_key, code, entity_id, name in rows[:limit]]
+
+
+def _substring_matches(q, limit, after, dialect):
+    low = fold_case(q, dialect)
+    like = '%' + _escape_like(q) + '%'
+    rows = []
+    for code, (kind, model) in enumerate(SEARCH_KINDS):
+        min_id = 0
+        if after is not None:
+            # (id, kind) > (after_id, after_kind) for a fixed kind
+            min_id = after[1] if code > after[0] else after[1] + 1
+        if dialect == 'sqlite':
+            table = model.__tablename__ + '_search'
+            stmt = text(
+                "SELECT rowid, name FROM {table} WHERE {table} MATCH :match AND rowid >= :min_id "
+                "AND name NOT LIKE :prefix ESCAPE '\\' ORDER BY rowid LIMIT :limit".format(table=table)
+            ).bindparams(match='"%s"' % q.replace('"', '""'), min_id=min_id,
+                         prefix=_escape_like(q) + '%', limit=limit)
+        else:
+            key = prefix_key(model, dialect)
+            stmt = (select(model.id, model.name)
+                    .where(model.name.ilike(like, escape='\\'), model.id >= min_id,
+                           ~and_(key >= low, key < low + PREFIX_END))
+                    .order_by(model.id).limit(limit))
+        rows += [(row[0], code, row[1]) for row in db.session.execute(stmt)]
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return [(1, None, code, entity_id, name) for entity_id, code, name in rows[:limit]]
+
+
+def search(q, limit=DEFAULT_SEARCH_LIMIT, after=None):
+    """Returns (results, next cursor or None) for one page of a name search."""
+    dialect = _dialect()
+    tier, position = 0, None
+    if after is not None:
+        values = decode_cursor(after, 4)
+        tier, sort_key, code, entity_id = values
+        # prefix cursors carry the folded name, substring cursors none
+        key_ok = isinstance(sort_key, str) if tier == 0 else sort_key is None
+        if tier not in (0, 1) or not key_ok or not isinstance(code, int) or not isinstance(entity_id, int):
+            raise APIException("Invalid cursor", status_code=400)
+        position = (sort_key, code, entity_id) if tier == 0 else (code, entity_id)
+
+    # one extra row tells if there is a next page
+    matches = []
+    if tier == 0:
+        matches = _prefix_matches(q, limit + 1, position, dialect)
+        position = None
+    if len(matches) <= limit and len(q) >= MIN_SUBSTRING_LENGTH:
+        matches += _substring_matches(q, limit + 1 - len(matches), position, dialect)
+
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        last_tier, sort_key, code, entity_id, _ = matches[-1]
+        next_cursor = encode_cursor([last_tier, sort_key, code, entity_id])
+    results = [{"kind": SEARCH_KINDS[code][0], "id": entity_id, "name": name}
+               for _, _, code, entity_id, name in matches]
+    return results, next_cursor
+
+
+SQLITE_INSERT_TRIGGER = ("CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN "
+                         "INSERT INTO {table}_search(rowid, name) VALUES (new.id, new.name); END")
+SQLITE_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_{table}_name_nocase ON {table} (name COLLATE NOCASE)",
+    # external content: the FTS table only stores the trigram index, names stay in {table}
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {table}_search USING fts5("
+    "name, content='{table}', content_rowid='id', tokenize='trigram')",
+    SQLITE_INSERT_TRIGGER,
+    "CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {table}_search({table}_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF name ON {table} BEGIN "
+    "INSERT INTO {table}_search({table}_search, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO {table}_search(rowid, name) VALUES (new.id, new.name); END",
+]
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS ix_{table}_name_lower ON {table} (lower(name) COLLATE "C")',
+]
+
+
+def pause_search_sync(model):
+    """Drops the FTS insert trigger of model's table on SQLite, so a bulk
+    insert does not index its rows one trigger run at a time.
+
+    Returns the id to pass to resume_search_sync(), None when there is
+    nothing to pause. Call it after the transaction wrote something: DDL is
+    transactional in SQLite, but pysqlite only opens the transaction for DML.
+    """
+    if _dialect() != 'sqlite':
+        return None
+    table = model.__tablename__
+    exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                                {"name": table + '_search_insert'}).scalar()
+    if not exists:
+        return None
+    db.session.execute(text("DROP TRIGGER %s_search_insert" % table))
+    return db.session.execute(select(func.coalesce(func.max(model.id), 0))).scalar()
+
+
+def resume_search_sync(model, after_id):
+    """Indexes the rows inserted since pause_search_sync() in one statement
+    and puts the trigger back. Names never change on an upsert by name, so
+    only new rows (id above after_id) are missing from the FTS table."""
+    table = model.__tablename__
+    db.session.execute(text("INSERT INTO {table}_search(rowid, name) SELECT id, name FROM {table} "
+                            "WHERE id > :after_id".format(table=table)), {"after_id": after_id})
+    db.session.execute(text(SQLITE_INSERT_TRIGGER.format(table=table)))
+
+
+for _, _model in SEARCH_KINDS:
+    _table = _model.__tablename__
+    for _statement in SQLITE_DDL:
+        event.listen(_model.__table__, 'after_create', DDL(_statement.format(table=_table)).execute_if(dialect='sqlite'))
+    for _statement in POSTGRES_DDL:
+        event.listen(_model.__table__, 'after_create', DDL(_statement.format(table=_table)).execute_if(dialect='postgresql'))
+    # the triggers go with the table, the FTS table has to be dropped by hand
+    event.listen(_model.__table__, 'after_drop',
+                 DDL("DROP TABLE IF EXISTS %s_search" % _table).execute_if(dialect='sqlite'))
@@ -1,4 +1,23 @@
-from flask import jsonify, url_for
+import os
+import json
+import base64
+import codecs
+import operator
+from itertools import chain
+from flask import jsonify, url_for, request, current_app, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from urllib.parse import urlencode
+from sqlalchemy import Integer, select, and_, or_, false
+from models import db
+
+try:
+    import orjson
+except ImportError:  # optional, the standard json module is used instead
+    orjson = None
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 500
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +34,44 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed."""
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('cls') or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        if orjson is None or pretty:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj) + b"\n", mimetype=self.mimetype)
+
+def require_internal_token():
+    # internal endpoints are open unless INTERNAL_API_TOKEN is set, then the
+    # token must come in X-Internal-Token or as a Bearer token (for Prometheus)
+    token = os.getenv('INTERNAL_API_TOKEN')
+    if not token:
+        return
+    sent = request.headers.get('X-Internal-Token') or request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    if sent != token:
+        raise APIException("Forbidden", status_code=403)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
-def generate_sitemap(app):
-    links = ['/admin/']
+def generate_sitemap(app, admin=True):
+    links = ['/admin/'] if admin else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -39,3 +89,263 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+
+def get_page_args(args):
+    # keyset pagination is opt-in, without limit/after the full list is returned
+    if 'limit' not in args and 'after' not in args:
+        return None, None
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return min(limit, MAX_PAGE_LIMIT), args.get('after')
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise APIException("Invalid cursor", status_code=400)
+    return values
+
+FILTER_OPERATORS = {
+    'eq': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+def _coerce(column, value):
+    if isinstance(column.type, Integer):
+        try:
+            return int(value)
+        except ValueError:
+            raise APIException("%s must be an integer" % column.key, status_code=400)
+    return value
+
+def apply_filters(query, model, args):
+    """Filters like ?climate=arid, ?population__gte=1000 or ?climate__in=arid,frozen
+    on the columns whitelisted in model.filter_fields."""
+    for key, value in args.items(multi=True):
+        name, _, op = key.partition('__')
+        if name not in model.serialize_fields:
+            continue
+        if name not in model.filter_fields:
+            raise APIException("Can not filter by %s" % name, status_code=400)
+        column = getattr(model, name)
+        if op == 'in':
+            query = query.filter(column.in_([_coerce(column, v) for v in value.split(',')]))
+        elif op in FILTER_OPERATORS or op == '':
+            query = query.filter(FILTER_OPERATORS[op or 'eq'](column, _coerce(column, value)))
+        else:
+            raise APIException("Unknown filter operator: %s" % op, status_code=400)
+    return query
+
+def get_sort(model, args):
+    # ?sort=-population,name, the id is always the last key so the order is total
+    sort = []
+    for name in args.get('sort', '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        descending = name.startswith('-')
+        name = name.lstrip('-+')
+        if name not in model.sort_fields:
+            raise APIException("Can not sort by %s" % name, status_code=400)
+        if name != 'id':
+            sort.append((name, descending))
+    return sort
+
+def _order_by(column, descending):
+    # NULLs go where a default btree index keeps them on Postgres
+    return column.desc().nulls_first() if descending else column.asc().nulls_last()
+
+def _after(column, descending, value):
+    if descending:
+        return column.isnot(None) if value is None else column < value
+    return false() if value is None else or_(column > value, column.is_(None))
+
+def _same(column, value):
+    return column.is_(None) if value is None else column == value
+
+def keyset_filter(model, sort, values):
+    # (a, b, id) > (va, vb, vid) expanded so it works with mixed directions and NULLs
+    keys = [(getattr(model, name), descending) for name, descending in sort] + [(model.id, False)]
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [_same(keys[j][0], values[j]) for j in range(i)]
+        clauses.append(and_(*(equal + [_after(column, descending, values[i])])))
+    return or_(*clauses)
+
+
+def wants_stream(args):
+    return args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def get_fields(model, args):
+    # sparse fieldsets: ?fields=name,height, the id is always returned
+    fields = model.serialize_fields
+    requested = args.get('fields')
+    if not requested:
+        return list(fields)
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise APIException("Unknown fields: %s" % ", ".join(unknown), status_code=400)
+    return ['id'] + [name for name in fields if name in names and name != 'id']
+
+def build_list_query(model, args):
+    """Returns (statement, fields, sort) for a list request. The statement
+    selects plain columns only, so no ORM objects are built. It is shared
+    by the Flask views and the async read endpoints in asgi.py."""
+    fields = get_fields(model, args)
+    sort = get_sort(model, args)
+    names = fields + [name for name, _ in sort if name not in fields]
+    stmt = apply_filters(select(*[getattr(model, name) for name in names]), model, args)
+    stmt = stmt.order_by(*[_order_by(getattr(model, name), descending) for name, descending in sort] + [model.id])
+    return stmt, fields, sort
+
+def paginate(stmt, model, sort, args):
+    # returns (statement, limit), limit is None when pagination was not asked for
+    limit, after = get_page_args(args)
+    if limit is None:
+        return stmt, None
+    if after is not None and sort:
+        stmt = stmt.where(keyset_filter(model, sort, decode_cursor(after, len(sort) + 1)))
+    elif after is not None:
+        try:
+            stmt = stmt.where(model.id > int(after))
+        except ValueError:
+            raise APIException("after must be an integer", status_code=400)
+    # fetch one extra row to know if there is a next page without a COUNT(*)
+    return stmt.limit(limit + 1), limit
+
+def split_page(rows, sort, limit):
+    # returns (rows of this page, cursor of the next page or None)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    if sort:
+        return rows, encode_cursor([last[name] for name, _ in sort] + [last['id']])
+    return rows, last['id']
+
+def next_page_headers(path, args, limit, next_cursor):
+    args = args.to_dict()
+    args.update(limit=limit, after=next_cursor)
+    return {
+        'Link': '<%s?%s>; rel="next"' % (path, urlencode(args)),
+        'X-Next-Cursor': str(next_cursor),
+    }
+
+def stream_json_list(stmt, fields, batch_size=STREAM_BATCH_SIZE):
+    # rows are plain tuples and only one batch of them is alive at any time
+    dumps = current_app.json.dumps
+    def generate():
+        yield '['
+        first = True
+        for row in db.session.execute(stmt.execution_options(yield_per=batch_size)):
+            yield ('' if first else ',') + dumps(dict(zip(fields, row)))
+            first = False
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def keyset_list_response(model):
+    stmt, fields, sort = build_list_query(model, request.args)
+    if wants_stream(request.args):
+        return stream_json_list(stmt, fields)
+
+    stmt, limit = paginate(stmt, model, sort, request.args)
+    rows = db.session.execute(stmt).all()
+    if limit is None:
+        return jsonify([dict(zip(fields, row)) for row in rows]), 200
+
+    rows, next_cursor = split_page(rows, sort, limit)
+    response = jsonify([dict(zip(fields, row)) for row in rows])
+    if next_cursor is not None:
+        response.headers.extend(next_page_headers(request.path, request.args, limit, next_cursor))
+    return response, 200
+
+
+def iter_text(stream, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def iter_json_array(texts):
+    # incremental parser for a top level JSON array, yields one item at a time
+    decoder = json.JSONDecoder()
+    buf, pos = '', 0
+    started, expect_value, count = False, True, 0
+    for text in chain(texts, [None]):
+        eof = text is None
+        if not eof:
+            buf, pos = buf[pos:] + text, 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started, pos = True, pos + 1
+                continue
+            if buf[pos] == ']' and (count == 0 or not expect_value):
+                return
+            if not expect_value:
+                if buf[pos] != ',':
+                    raise ValueError("Expected ',' or ']' at position %d" % pos)
+                expect_value, pos = True, pos + 1
+                continue
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                break  # the value is split between chunks
+            if not eof and (end == len(buf) or buf[end] not in ' \t\r\n,]'):
+                break  # a number like "-1." could continue in the next chunk
+            yield value
+            count, pos, expect_value = count + 1, end, False
+        if eof:
+            raise ValueError("Unexpected end of JSON array")
+
+def iter_ndjson(stream):
+    # yields (record, error) for every non blank line
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, "Invalid JSON: %s" % e
+
+def read_json_records(chunk_size=65536):
+    """Returns (data, records): a single JSON object in data, or an iterator
+    of (record, error) pairs in records for JSON arrays and NDJSON bodies.
+    The body is parsed incrementally so large uploads are never fully buffered."""
+    if request.mimetype == 'application/x-ndjson':
+        return None, iter_ndjson(request.stream)
+
+    texts = iter_text(request.stream, chunk_size)
+    head = ''
+    for text in texts:
+        head += text
+        if head.strip():
+            break
+    if not head.lstrip().startswith('['):
+        return json.loads(head + ''.join(texts)), None
+    return None, ((item, None) for item in iter_json_array(chain([head], texts)))
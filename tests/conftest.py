@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import pytest
+from sqlalchemy import event
+
+# the app reads its settings at import time, point it at a scratch database first
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+# the same file as replica, so read-only views go through the routing session
+os.environ['DATABASE_REPLICA_URLS'] = 'sqlite:///' + DB_PATH
+os.environ.pop('INTERNAL_API_TOKEN', None)
+os.environ.pop('CACHE_REDIS_URL', None)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import app as flask_app  # noqa: E402
+from cache import cache  # noqa: E402
+from favorites_index import favorites_index  # noqa: E402
+from models import db, User, People, Planets, Vehicles  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    cache.backend.clear()
+    favorites_index.clear()
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def catalog(app):
+    """Two users and three rows of every catalog table."""
+    with app.app_context():
+        for i in (1, 2):
+            db.session.add(User(id=i, email='user%d@example.com' % i, password='secret', is_active=True,
+                                first_name='First', last_name='Last', username='user%d' % i))
+        for i in (1, 2, 3):
+            db.session.add(People(id=i, name='Person %d' % i))
+            db.session.add(Planets(id=i, name='Planet %d' % i, climate='arid'))
+            db.session.add(Vehicles(id=i, name='Vehicle %d' % i))
+        db.session.commit()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(app):
+    """Counts the statements sent to the primary and the replica engines."""
+    from replicas import replicas
+    counter = QueryCounter()
+    with app.app_context():
+        engines = [db.engine] + list(replicas.engines)
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counter)
+    yield counter
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', counter)
@@ -0,0 +1,62 @@
+import pytest
+from models import db, Favorites, Planets
+
+
+@pytest.fixture
+def admin_client(app, catalog, monkeypatch):
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    return app.test_client()
+
+
+def _count(app, planet_id):
+    with app.app_context():
+        return db.session.get(Planets, planet_id).favorites_count
+
+
+def test_admin_favorite_keeps_counters(admin_client, app):
+    response = admin_client.post('/admin/favorites/new/', data={'user': '1', 'entity_type': 'planet', 'entity_id': '2'})
+    assert response.status_code == 302
+    assert _count(app, 2) == 1
+    with app.app_context():
+        favorite_id = Favorites.query.one().id
+    admin_client.post('/admin/favorites/delete/', data={'id': str(favorite_id)})
+    assert _count(app, 2) == 0
+
+
+def test_admin_rejects_a_missing_entity(admin_client, app):
+    response = admin_client.post('/admin/favorites/new/', data={'user': '1', 'entity_type': 'planet', 'entity_id': '99999'})
+    assert b'There is no planet with id 99999' in response.data
+    with app.app_context():
+        assert Favorites.query.count() == 0
+        assert db.session.query(db.func.sum(Planets.favorites_count)).scalar() == 0
+
+
+@pytest.fixture
+def primary_only(monkeypatch):
+    # replica reads are never cached, these tests need the responses stored
+    from replicas import replicas
+    monkeypatch.setattr(replicas, 'engines', [])
+
+
+def test_admin_catalog_edits_reach_the_api_cache(admin_client, app, primary_only):
+    assert admin_client.get('/planets/1').json['name'] == 'Planet 1'
+    assert admin_client.get('/planets/1').headers['X-Cache'] == 'HIT'
+    admin_client.get('/planets')
+    admin_client.get('/search?q=tatoo')
+    response = admin_client.post('/admin/planets/edit/?id=1', data={'name': 'Tatooine', 'climate': 'arid'})
+    assert response.status_code == 302
+    assert admin_client.get('/planets/1').json['name'] == 'Tatooine'
+    assert admin_client.get('/search?q=tatoo').json[0]['id'] == 1
+
+    response = admin_client.post('/admin/planets/new/', data={'name': 'Hoth', 'climate': 'frozen'})
+    assert response.status_code == 302
+    assert 'Hoth' in [planet['name'] for planet in admin_client.get('/planets').json]
+
+
+def test_admin_catalog_delete_drops_the_favorites_index(admin_client, app, primary_only):
+    admin_client.post('/favorite/planet/3?user_id=2')
+    assert admin_client.get('/users/2/favorites/contains?planet_ids=3').json == {"planet_ids": [3]}
+    assert len(admin_client.get('/planets').json) == 3
+    assert admin_client.post('/admin/planets/delete/', data={'id': '3'}).status_code == 302
+    assert admin_client.get('/users/2/favorites/contains?planet_ids=3').json == {"planet_ids": []}
+    assert [planet['id'] for planet in admin_client.get('/planets').json] == [1, 2]
@@ -0,0 +1,49 @@
+import asyncio
+import httpx
+import pytest
+from asgi import application, engine, replica_engines
+
+
+def get(path, headers=None):
+    async def request():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            response = await client.get(path, headers=headers)
+        # the async engines hold aiosqlite threads bound to this loop
+        for async_engine in [engine] + replica_engines:
+            await async_engine.dispose()
+        return response
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize('path', ['/people/1', '/planets/1', '/vehicles/1'])
+def test_item_etag_matches_flask(client, catalog, path):
+    flask_response = client.get(path)
+    response = get(path)
+    assert response.status_code == 200
+    assert response.json() == flask_response.json
+    assert response.headers['etag'] == flask_response.headers['ETag']
+
+    assert get(path, {'If-None-Match': response.headers['etag']}).status_code == 304
+
+
+def test_item_etag_follows_patch(client, catalog):
+    etag = get('/planets/1').headers['etag']
+    client.patch('/update/planet/1', json={"climate": "frozen"}, headers={'If-Match': etag})
+    response = get('/planets/1', {'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+def test_user_favorites_non_numeric_id(client, catalog):
+    assert client.get('/users/favorites?user_id=abc').json == []
+    response = get('/users/favorites?user_id=abc')
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_user_favorites_matches_flask(client, catalog):
+    client.post('/favorite/vehicle/2?user_id=1')
+    client.post('/favorite/planet/3?user_id=1')
+    for path in ('/users/favorites?user_id=1', '/users/favorites?user_id=1&expand=true'):
+        assert get(path).json() == client.get(path).json
@@ -0,0 +1,25 @@
+def test_bulk_create_reports_row_errors(client, catalog):
+    response = client.post('/create/planet/', json=[
+        {"name": "New planet"},
+        {"name": {"a": 1}},
+        {"name": ["x"]},
+        {"name": "New planet"},
+        {"name": "Planet 1"},
+        {"climate": "arid"},
+    ])
+    assert response.status_code == 207
+    assert response.json['created'] == 1
+    assert [(error['index'], error['error'].split(':')[0]) for error in response.json['errors']] == [
+        (1, 'name must be a string'),
+        (2, 'name must be a string'),
+        (3, 'Duplicated name in request'),
+        (4, 'Name already exists'),
+        (5, 'Missing required field'),
+    ]
+
+
+def test_bulk_create_ndjson(client, catalog):
+    body = '{"name": "Ndjson 1"}\n{"name": "Ndjson 2", "population": 10}\n'
+    response = client.post('/create/planet/', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert response.json['created'] == 2
@@ -0,0 +1,30 @@
+from cache import LocalBackend
+
+
+def test_versions_are_bounded():
+    backend = LocalBackend(max_versions=3)
+    for user_id in range(10):
+        backend.incr_version('favorites:user:%s' % user_id)
+    assert len(backend._versions) == 3
+
+
+def test_an_evicted_version_never_goes_back():
+    backend = LocalBackend(max_versions=2)
+    backend.incr_version('people')
+    backend.incr_version('people')
+    seen = backend.get_version('people')
+    backend.incr_version('planets')
+    backend.incr_version('vehicles')
+    assert 'people' not in backend._versions
+    # entries stored under an older version stay unreachable
+    assert backend.get_version('people') >= seen
+    assert backend.incr_version('people') > seen
+
+
+def test_reading_a_version_keeps_it():
+    backend = LocalBackend(max_versions=2)
+    backend.incr_version('people')
+    backend.incr_version('planets')
+    backend.get_version('people')
+    backend.incr_version('vehicles')
+    assert set(backend._versions) == {'people', 'vehicles'}
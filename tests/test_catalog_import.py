@@ -0,0 +1,179 @@
+import json
+import pytest
+from sqlalchemy import text
+from catalog_import import _PostgresStaging, import_records, to_int
+from models import db, People, Planets, Vehicles
+
+
+def seed(app, *args):
+    return app.test_cli_runner().invoke(args=['seed'] + [str(arg) for arg in args])
+
+
+def rows(app, model):
+    with app.app_context():
+        return {row.name: row for row in db.session.execute(db.select(model)).scalars()}
+
+
+def has_search_trigger(app, table):
+    with app.app_context():
+        return db.session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                                  {"name": table + '_search_insert'}).scalar() == 1
+
+
+@pytest.mark.parametrize('value, expected', [
+    (172, 172),
+    ('172', 172),
+    ('1,000,000', 1000000),
+    ('1 standard', 1),
+    ('0.9', 0),
+    ('-3', -3),
+    ('unknown', None),
+    ('n/a', None),
+    (None, None),
+    (True, None),
+    ('200000000000', None),
+    (2 ** 31, None),
+])
+def test_to_int(value, expected):
+    assert to_int(value) == expected
+
+
+def test_csv_upserts_by_name(app, catalog, tmp_path):
+    path = tmp_path / 'people.csv'
+    path.write_text('name,height,gender,eye_color,skin_color\n'
+                    'Person 1,172,male,blue,fair\n'
+                    'Person 2,,,,\n'
+                    'Luke Skywalker,172,male,blue,fair\n'
+                    ',180,,,\n')
+    result = seed(app, path)
+    assert result.exit_code == 0, result.output
+    assert '1 inserted, 1 updated, 1 unchanged, 1 skipped' in result.output
+
+    people = rows(app, People)
+    assert (people['Person 1'].height, people['Person 1'].gender, people['Person 1'].version) == (172, 'male', 2)
+    # same values as the file, no new version
+    assert people['Person 2'].version == 1
+    assert people['Luke Skywalker'].version == 1
+    assert len(people) == 4
+
+
+def test_reimporting_the_same_file_changes_nothing(app, catalog, tmp_path):
+    path = tmp_path / 'people.csv'
+    path.write_text('name,height\nPerson 1,172\n')
+    seed(app, path)
+    result = seed(app, path)
+    assert '0 inserted, 0 updated, 1 unchanged' in result.output
+    assert rows(app, People)['Person 1'].version == 2
+
+
+def test_ndjson_numbers_and_repeated_names(app, catalog, tmp_path):
+    path = tmp_path / 'planets.ndjson'
+    path.write_text('\n'.join(json.dumps(record) for record in [
+        {"name": "Tatooine", "population": "200000", "gravity": "1 standard", "diameter": "unknown"},
+        {"name": "Planet 1", "climate": "arid", "population": "1,000,000"},
+        {"name": "Tatooine", "population": "120000", "climate": "arid"},
+    ]) + '\n\n')
+    result = seed(app, path, '--chunk-size', 1)
+    assert result.exit_code == 0, result.output
+
+    planets = rows(app, Planets)
+    # the later row wins
+    assert (planets['Tatooine'].population, planets['Tatooine'].gravity, planets['Tatooine'].climate) == (120000, None, 'arid')
+    assert planets['Planet 1'].population == 1000000
+
+
+def test_swapi_fixture(app, catalog, tmp_path):
+    path = tmp_path / 'vehicles.json'
+    path.write_text(json.dumps([
+        {"model": "resources.vehicle", "pk": 4,
+         "fields": {"name": "Sand Crawler", "model": "Digger Crawler", "cost_in_credits": "150000",
+                    "length": "36.8 ", "crew": "46", "passengers": "30"}},
+        {"model": "resources.vehicle", "pk": 6, "fields": {"name": "T-16 skyhopper", "crew": "1"}},
+    ]))
+    result = seed(app, path)
+    assert result.exit_code == 0, result.output
+
+    vehicles = rows(app, Vehicles)
+    crawler = vehicles['Sand Crawler']
+    assert (crawler.model, crawler.cost_in_credits, crawler.length, crawler.crew) == ('Digger Crawler', 150000, 36, 46)
+    assert vehicles['T-16 skyhopper'].crew == 1
+
+
+def test_imported_rows_are_searchable(app, catalog, client, tmp_path):
+    path = tmp_path / 'people.ndjson'
+    path.write_text('{"name": "Luke Skywalker"}\n{"name": "Anakin Skywalker"}\n')
+    assert seed(app, path, '--chunk-size', 1).exit_code == 0
+    assert has_search_trigger(app, 'people')
+
+    response = client.get('/search?q=skywalker')
+    assert sorted(row['name'] for row in response.json) == ['Anakin Skywalker', 'Luke Skywalker']
+
+
+def test_search_trigger_is_back_after_a_failed_import(app, catalog, client, tmp_path):
+    path = tmp_path / 'people.ndjson'
+    # the first chunk is written (and the trigger dropped) before the second line fails to parse
+    path.write_text('{"name": "Luke Skywalker"}\nnot json\n')
+    result = seed(app, path, '--chunk-size', 1)
+    assert result.exit_code != 0
+    assert 'Luke Skywalker' not in rows(app, People)
+    assert has_search_trigger(app, 'people')
+
+    client.post('/create/people/', json={'name': 'Leia Skywalker'})
+    response = client.get('/search?q=skywalker')
+    assert [row['name'] for row in response.json] == ['Leia Skywalker']
+
+
+class FakePostgresConnection:
+    """Records what _PostgresStaging sends, Postgres is not available here."""
+
+    def __init__(self, driver):
+        self.dialect = type('Dialect', (), {'driver': driver})()
+        self.statements = []
+        self.copied = []
+        self.connection = self
+
+    def exec_driver_sql(self, statement):
+        self.statements.append(statement)
+
+    def execute(self, statement, rows):
+        self.statements.append((str(statement), rows))
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, statement, buffer):
+        self.copied.append((statement, buffer.read()))
+
+
+@pytest.mark.parametrize('driver', ['psycopg2', 'pg8000'])
+def test_postgres_staging(app, monkeypatch, driver):
+    connection = FakePostgresConnection(driver)
+    rows = [{'name': 'Tatooine', 'population': None}, {'name': 'Alderaan', 'population': 2000000000}]
+    with app.app_context():
+        monkeypatch.setattr(db.session, 'connection', lambda: connection)
+        staging = _PostgresStaging(Planets, ['name', 'population'])
+        staging.write(rows)
+
+    assert connection.statements[0].startswith('CREATE TEMPORARY TABLE seed_staging ON COMMIT DROP')
+    if driver == 'psycopg2':
+        # None is an unquoted empty field, NULL for COPY ... csv
+        assert connection.copied == [('COPY seed_staging (name, population) FROM STDIN WITH (FORMAT csv)',
+                                      'Tatooine,\r\nAlderaan,2000000000\r\n')]
+    else:
+        assert connection.copied == []
+        assert connection.statements[-1] == ('INSERT INTO seed_staging (name, population) '
+                                             'VALUES (:name, :population)', rows)
+
+
+def test_import_records_skips_what_is_not_a_record(app, catalog):
+    with app.app_context():
+        inserted, updated, skipped = import_records(People, [{'name': 'Han Solo'}, ['Han'], 'Han', {'height': 1}],
+                                                    ['name', 'height'])
+        db.session.commit()
+    assert (inserted, updated, skipped) == (1, 0, 3)
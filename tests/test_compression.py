@@ -0,0 +1,78 @@
+import gzip
+import json
+import pytest
+import compression
+from models import db, Planets
+
+
+@pytest.fixture
+def planets(app):
+    # about 6KB of JSON, well over COMPRESS_MIN_SIZE
+    with app.app_context():
+        db.session.add_all([Planets(name='Planet %03d' % i, climate='temperate') for i in range(60)])
+        db.session.commit()
+
+
+def test_large_bodies_are_gzipped(client, planets):
+    response = client.get('/planets', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = gzip.decompress(response.data)
+    assert len(json.loads(body)) == 60
+    assert len(response.data) < len(body) / 3
+
+
+def test_small_bodies_are_sent_as_they_are(client, catalog):
+    response = client.get('/planets/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.json['name'] == 'Planet 1'
+
+
+def test_identity_unless_gzip_is_accepted(client, planets):
+    for accept in (None, 'identity', 'gzip;q=0', 'deflate'):
+        headers = {'Accept-Encoding': accept} if accept else {}
+        response = client.get('/planets', headers=headers)
+        assert 'Content-Encoding' not in response.headers, accept
+        assert len(response.json) == 60
+
+
+def test_brotli_is_only_offered_when_installed(client, planets, monkeypatch):
+    monkeypatch.setattr(compression, 'HAS_BROTLI', False)
+    response = client.get('/planets', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in response.headers
+    response = client.get('/planets', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_brotli_wins_a_tie(client, planets, monkeypatch):
+    brotli = pytest.importorskip('brotli')
+    monkeypatch.setattr(compression, 'HAS_BROTLI', True)
+    response = client.get('/planets', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert len(json.loads(brotli.decompress(response.data))) == 60
+
+
+def test_streams_are_compressed_whole(client, planets):
+    response = client.get('/planets?stream=true', headers={'Accept-Encoding': 'gzip'})
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert [row['id'] for row in json.loads(gzip.decompress(response.data))] == list(range(1, 61))
+
+
+def test_compressed_etags_are_weak_and_still_match(client, planets, monkeypatch):
+    monkeypatch.setattr(compression.compression, 'min_size', 0)
+    response = client.get('/planets/1', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    response = client.get('/planets/1', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_errors_are_not_compressed(client, planets, monkeypatch):
+    monkeypatch.setattr(compression.compression, 'min_size', 0)
+    response = client.get('/planets?population=many', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 400
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,131 @@
+def add(client, kind, entity_id, user_id=1):
+    return client.post('/favorite/%s/%d?user_id=%d' % (kind, entity_id, user_id))
+
+
+def _expand(client, count_queries):
+    del count_queries.statements[:]
+    response = client.get('/users/favorites?user_id=1&expand=true')
+    assert response.status_code == 200
+    return response.json, len(count_queries)
+
+
+def test_expand_query_count_does_not_grow_with_the_list(client, app, catalog, count_queries):
+    from models import db, People, Planets, Vehicles
+    for kind in ('planet', 'people', 'vehicle'):
+        add(client, kind, 1)
+    small, small_queries = _expand(client, count_queries)
+    assert len(small) == 3
+
+    with app.app_context():
+        for i in range(4, 13):
+            db.session.add_all([People(id=i, name='Person %d' % i), Planets(id=i, name='Planet %d' % i),
+                                Vehicles(id=i, name='Vehicle %d' % i)])
+        db.session.commit()
+    for kind in ('planet', 'people', 'vehicle'):
+        for entity_id in range(2, 12):
+            add(client, kind, entity_id)
+    large, large_queries = _expand(client, count_queries)
+    assert len(large) == 33
+    assert large_queries == small_queries == 1
+
+
+def test_expand_embeds_only_the_favorite_kind(client, catalog):
+    add(client, 'planet', 2)
+    add(client, 'people', 3)
+    response = client.get('/users/favorites?user_id=1&expand=true')
+    planet, people = response.json
+    assert planet['planet']['name'] == 'Planet 2'
+    assert planet['people'] is None and planet['vehicle'] is None
+    assert people['people']['name'] == 'Person 3' and people['planet'] is None
+
+
+def test_add_and_remove(client, catalog):
+    assert add(client, 'planet', 1).status_code == 200
+    assert add(client, 'planet', 1).status_code == 400
+    assert add(client, 'planet', 99).status_code == 404
+    assert client.delete('/favorite/planet/1?user_id=1').status_code == 200
+    assert client.delete('/favorite/planet/1?user_id=1').status_code == 404
+
+
+def test_user_id_must_be_an_integer(client, app, catalog):
+    from models import Favorites
+    for query in ('?user_id=1.0', '?user_id=abc', ''):
+        assert client.post('/favorite/people/1' + query).status_code == 400
+        assert client.delete('/favorite/people/1' + query).status_code == 400
+    with app.app_context():
+        assert Favorites.query.count() == 0
+
+
+def test_batch_statuses(client, catalog):
+    add(client, 'planet', 1)
+    response = client.post('/users/1/favorites:batch', json=[
+        {"kind": "planet", "id": 1},
+        {"kind": "planet", "id": 2},
+        {"kind": "planet", "id": 2},
+        {"kind": "vehicle", "id": 99},
+        {"kind": "starship", "id": 1},
+    ])
+    assert response.status_code == 200
+    assert [item['status'] for item in response.json['results']] == [
+        'already_favorite', 'added', 'already_favorite', 'not_found', 'invalid']
+
+    response = client.delete('/users/1/favorites:batch', json={"favorites": [
+        {"kind": "planet", "id": 2},
+        {"kind": "planet", "id": 3},
+        {"kind": "people", "id": "1"},
+    ]})
+    assert [item['status'] for item in response.json['results']] == ['deleted', 'not_found', 'invalid']
+    assert client.post('/users/99/favorites:batch', json=[]).status_code == 404
+    assert client.post('/users/1/favorites:batch', json={"kind": "planet"}).status_code == 400
+
+
+def _favorites(app):
+    from models import Favorites
+    with app.app_context():
+        return sorted((f.entity_type, f.entity_id) for f in Favorites.query.all())
+
+
+def test_entity_delete_cascades_only_its_kind(client, app, catalog):
+    # the same id in three tables, only the deleted row's favorites go away
+    for kind in ('planet', 'people', 'vehicle'):
+        add(client, kind, 1)
+    assert client.delete('/delete/planet/1').status_code == 200
+    assert _favorites(app) == [('people', 1), ('vehicle', 1)]
+
+
+def test_bulk_delete_cascades(client, app, catalog):
+    from models import db, People
+    for entity_id in (1, 2, 3):
+        add(client, 'people', entity_id)
+        add(client, 'vehicle', entity_id)
+    assert client.delete('/people?ids=1,2').json['deleted'] == 2
+    assert _favorites(app) == [('people', 3), ('vehicle', 1), ('vehicle', 2), ('vehicle', 3)]
+    with app.app_context():
+        assert db.session.get(People, 3).favorites_count == 1
+
+
+def contains(client, user_id, query):
+    return client.get('/users/%d/favorites/contains?%s' % (user_id, query)).json
+
+
+def test_entity_deletes_drop_the_membership_index(client, catalog):
+    add(client, 'planet', 1)
+    add(client, 'planet', 2, user_id=2)
+    add(client, 'vehicle', 3, user_id=2)
+    # loads both users into the index
+    assert contains(client, 1, 'planet_ids=1,2') == {'planet_ids': [1]}
+    assert contains(client, 2, 'planet_ids=1,2&vehicle_ids=3') == {'planet_ids': [2], 'vehicle_ids': [3]}
+
+    client.delete('/delete/planet/1')
+    client.delete('/vehicles?ids=3')
+    assert contains(client, 1, 'planet_ids=1,2') == {'planet_ids': []}
+    assert contains(client, 2, 'planet_ids=1,2&vehicle_ids=3') == {'planet_ids': [2], 'vehicle_ids': []}
+
+
+def test_a_reused_id_is_not_a_favorite(client, catalog):
+    # SQLite hands the highest id out again once its row is deleted
+    add(client, 'people', 3)
+    assert contains(client, 1, 'people_ids=3') == {'people_ids': [3]}
+    client.delete('/delete/people/3')
+    assert client.post('/create/people/', json={"name": "Someone new"}).json['People']['id'] == 3
+    assert contains(client, 1, 'people_ids=3') == {'people_ids': []}
@@ -0,0 +1,73 @@
+import pytest
+from models import db, Planets
+
+
+@pytest.fixture
+def planets(app):
+    with app.app_context():
+        db.session.add_all([Planets(name='Planet %02d' % i, climate='arid' if i % 2 else 'frozen',
+                                    population=i * 100 if i % 5 else None) for i in range(25)])
+        db.session.commit()
+
+
+def names(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.json
+    return [row['name'] for row in response.json]
+
+
+def test_equality_range_and_in_filters(client, planets):
+    assert names(client, '/planets?climate=arid&population__lt=600') == ['Planet 01', 'Planet 03']
+    assert names(client, '/planets?population__gte=2300') == ['Planet 23', 'Planet 24']
+    assert names(client, '/planets?population__in=100,200&climate=frozen') == ['Planet 02']
+
+
+def test_sort_puts_nulls_last_ascending_and_first_descending(client, planets):
+    ascending = names(client, '/planets?sort=population&fields=name')
+    assert ascending[:2] == ['Planet 01', 'Planet 02']
+    assert ascending[-5:] == ['Planet 00', 'Planet 05', 'Planet 10', 'Planet 15', 'Planet 20']
+    descending = names(client, '/planets?sort=-population,name')
+    assert descending[:2] == ['Planet 00', 'Planet 05']
+    assert descending[5] == 'Planet 24'
+
+
+def test_bad_filters_are_rejected(client, planets):
+    # gravity is serialized but not whitelisted, diameter__like is not an operator
+    assert client.get('/planets?gravity=1').status_code == 400
+    assert client.get('/planets?diameter__like=1').status_code == 400
+    assert client.get('/planets?population=many').status_code == 400
+    assert client.get('/planets?population__in=1,x').status_code == 400
+    assert client.get('/planets?sort=gravity').status_code == 400
+
+
+def test_unknown_parameters_are_ignored(client, planets):
+    assert len(names(client, '/planets?utm_source=mail')) == 25
+
+
+def test_cursor_keeps_sort_and_filters(client, app, planets):
+    with app.app_context():
+        expected = [planet.name for planet in
+                    Planets.query.filter_by(climate='arid').order_by(Planets.name.desc(), Planets.id.desc())]
+
+    seen, after = [], None
+    while True:
+        url = '/planets?climate=arid&sort=-name&limit=5' + ('&after=%s' % after if after else '')
+        response = client.get(url)
+        seen += [row['name'] for row in response.json]
+        after = response.headers.get('X-Next-Cursor')
+        if after is None:
+            break
+    assert seen == expected
+
+
+def test_cursor_pages_through_null_sort_keys(client, app, planets):
+    seen, after = [], None
+    while True:
+        url = '/planets?sort=population&limit=4' + ('&after=%s' % after if after else '')
+        response = client.get(url)
+        seen += [row['name'] for row in response.json]
+        after = response.headers.get('X-Next-Cursor')
+        if after is None:
+            break
+    assert seen == names(client, '/planets?sort=population')
+    assert client.get('/planets?sort=population&limit=4&after=WzFd').status_code == 400
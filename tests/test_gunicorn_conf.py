@@ -0,0 +1,52 @@
+import os
+import runpy
+
+import pytest
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py')
+
+
+@pytest.fixture
+def load_conf(monkeypatch):
+    for name in ('GUNICORN_PROFILE', 'GUNICORN_WORKER_CLASS', 'GUNICORN_THREADS', 'WEB_CONCURRENCY',
+                 'GUNICORN_MAX_WORKERS', 'GUNICORN_WORKER_MEMORY_MB', 'GUNICORN_MEMORY_MB',
+                 'DB_POOL_SIZE', 'DB_MAX_OVERFLOW'):
+        monkeypatch.delenv(name, raising=False)
+
+    def load(cpus=4, **env):
+        monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(cpus)), raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return runpy.run_path(CONF)
+    return load
+
+
+def test_defaults_to_the_cpu_profile(load_conf):
+    conf = load_conf()
+    assert conf['PROFILE'] == 'cpu'
+    assert conf['worker_class'] == 'sync'
+    assert conf['threads'] == 1
+
+
+def test_pool_is_sized_to_the_threads(load_conf):
+    conf = load_conf(GUNICORN_PROFILE='db')
+    assert os.environ['DB_POOL_SIZE'] == str(conf['threads'])
+    assert os.environ['DB_MAX_OVERFLOW'] == '0'
+
+
+def test_explicit_pool_settings_win(load_conf):
+    load_conf(GUNICORN_PROFILE='db', DB_POOL_SIZE='2', DB_MAX_OVERFLOW='1')
+    assert os.environ['DB_POOL_SIZE'] == '2'
+    assert os.environ['DB_MAX_OVERFLOW'] == '1'
+
+
+def test_single_worker_on_one_cpu(load_conf):
+    assert load_conf(cpus=1, GUNICORN_MEMORY_MB='4096')['workers'] == 1
+    assert load_conf(cpus=4, GUNICORN_MEMORY_MB='4096')['workers'] == 5
+
+
+def test_workers_are_capped_by_memory(load_conf):
+    assert load_conf(cpus=8, GUNICORN_MEMORY_MB='512')['workers'] == 4
+    assert load_conf(cpus=8, GUNICORN_MEMORY_MB='512', GUNICORN_WORKER_MEMORY_MB='256')['workers'] == 2
+    assert load_conf(cpus=8, GUNICORN_MEMORY_MB='64')['workers'] == 1
+    assert load_conf(cpus=8, GUNICORN_MEMORY_MB='512', WEB_CONCURRENCY='6')['workers'] == 6
@@ -0,0 +1,7 @@
+from bench import importtime
+
+
+def test_boot_stays_lazy_and_within_budget(capsys):
+    status = importtime.main(['--runs', '3'])
+    output = capsys.readouterr().out
+    assert status == 0, output
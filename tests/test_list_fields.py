@@ -0,0 +1,25 @@
+def test_fields_limits_the_columns(client, catalog):
+    response = client.get('/planets?fields=climate,name')
+    assert response.status_code == 200
+    assert response.json[0] == {"id": 1, "name": "Planet 1", "climate": "arid"}
+
+
+def test_fields_apply_to_pages_and_streams(client, catalog):
+    page = client.get('/people?fields=name&limit=2')
+    assert page.json == [{"id": 1, "name": "Person 1"}, {"id": 2, "name": "Person 2"}]
+    stream = client.get('/people?fields=name&stream=true')
+    assert [set(row) for row in stream.json] == [{"id", "name"}] * 3
+
+
+def test_unknown_fields_are_rejected(client, catalog):
+    assert client.get('/planets?fields=name,secret').status_code == 400
+    # password is not a serialized field of users, asking for it is an error too
+    assert client.get('/users?fields=password').status_code == 400
+
+
+def test_lists_serialize_like_the_items(client, catalog):
+    people = client.get('/people').json[0]
+    assert people == client.get('/people/1').json
+    users = client.get('/users').json
+    assert [user['username'] for user in users] == ['user1', 'user2']
+    assert 'password' not in users[0]
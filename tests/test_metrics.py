@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from models import db
+
+
+def test_failed_statements_leave_no_timing_behind(app, catalog):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(IntegrityError):
+                    connection.execute(text("INSERT INTO planets (id, name) VALUES (1, 'Planet 1')"))
+            connection.execute(text("SELECT 1"))
+            assert connection.info.get('metrics_query_start') == []
+
+
+def test_statements_are_counted_per_request(client, catalog):
+    client.patch('/update/planet/1', json={"name": "Planet 2"})  # 409, the UPDATE failed
+    client.get('/planets/1')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'db_statements_total' in body
+    assert 'http_requests_total{method="PATCH",endpoint="/update/planet/<int:planet_id>",status="409"} 1' in body
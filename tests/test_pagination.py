@@ -0,0 +1,57 @@
+from urllib.parse import urlparse
+from models import db, Planets
+
+
+def _planets(app, count=25):
+    with app.app_context():
+        db.session.add_all([Planets(name='Planet %02d' % i, climate='arid' if i % 2 else 'frozen')
+                            for i in range(count)])
+        db.session.commit()
+        return [planet.id for planet in Planets.query.order_by(Planets.id)]
+
+
+def test_keyset_cursor_round_trip(client, app):
+    expected = _planets(app)
+
+    seen, url, pages = [], '/planets?limit=10', 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen += [row['id'] for row in response.json]
+        pages += 1
+        link = response.headers.get('Link')
+        if link is None:
+            assert 'X-Next-Cursor' not in response.headers
+            break
+        next_url = urlparse(link[1:link.index('>')])
+        url = next_url.path + '?' + next_url.query
+    assert seen == expected
+    assert pages == 3
+
+
+def test_without_limit_the_full_list_is_returned(client, app):
+    expected = _planets(app)
+    response = client.get('/planets')
+    assert [row['id'] for row in response.json] == expected
+    assert 'Link' not in response.headers
+
+
+def test_invalid_cursor(client, app):
+    assert client.get('/planets?limit=5&after=not-a-cursor').status_code == 400
+    assert client.get('/planets?limit=0').status_code == 400
+    assert client.get('/planets?limit=ten').status_code == 400
+
+
+def test_stream_returns_the_whole_list(client, app):
+    expected = _planets(app)
+    response = client.get('/planets?stream=true')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert [row['id'] for row in response.json] == expected
+    assert response.json[0]['climate'] == 'frozen'
+
+
+def test_stream_of_an_empty_table(client, app):
+    response = client.get('/vehicles?stream=1')
+    assert response.json == []
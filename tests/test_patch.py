@@ -0,0 +1,47 @@
+from models import db, Planets
+
+
+def test_patch_with_if_match(client, catalog):
+    etag = client.get('/planets/1').headers['ETag']
+    response = client.patch('/update/planet/1', json={"climate": "frozen"}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.json['climate'] == 'frozen'
+    assert response.headers['ETag'] != etag
+
+    # the first ETag is stale now
+    response = client.patch('/update/planet/1', json={"climate": "murky"}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert client.get('/planets/1').json['climate'] == 'frozen'
+
+
+def test_patch_malformed_if_match(client, catalog):
+    response = client.patch('/update/planet/1', json={"climate": "murky"}, headers={'If-Match': '"1", "2"'})
+    assert response.status_code == 412
+
+
+def test_patch_unique_name_conflict(client, app, catalog):
+    response = client.patch('/update/planet/1', json={"name": "Planet 2"})
+    assert response.status_code == 409
+    with app.app_context():
+        assert db.session.get(Planets, 1).name == 'Planet 1'
+
+
+def test_patch_rejects_read_only_fields(client, catalog):
+    assert client.patch('/update/planet/1', json={"version": 7}).status_code == 400
+    assert client.patch('/update/planet/99', json={"climate": "arid"}).status_code == 404
+
+
+def test_patch_checks_the_column_types(client, app, catalog):
+    for body in ({"population": "many"}, {"population": 1.5}, {"population": True}, {"population": 2 ** 40},
+                 {"climate": 7}, {"climate": "x" * 81}, {"name": None}):
+        response = client.patch('/update/planet/1', json=body)
+        assert response.status_code == 400, body
+    assert client.patch('/update/planet/1', json={"population": None, "climate": "murky"}).status_code == 200
+    with app.app_context():
+        planet = db.session.get(Planets, 1)
+        assert (planet.population, planet.climate, planet.version) == (None, 'murky', 2)
+
+
+def test_patch_without_if_match_is_unconditional(client, catalog):
+    client.patch('/update/planet/1', json={"climate": "frozen"})
+    assert client.patch('/update/planet/1', json={"climate": "murky"}).status_code == 200
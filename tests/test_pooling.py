@@ -0,0 +1,53 @@
+import os
+import pytest
+from sqlalchemy import create_engine, exc, text
+from pooling import TimedQueuePool, engine_options_from_env, pool_stats
+from tests.conftest import DB_PATH
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite:///' + DB_PATH, poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    yield engine
+    engine.dispose()
+
+
+def test_checkouts_and_timeouts_are_counted(engine):
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        stats = pool_stats(engine)
+        assert stats['checked_out'] == 1
+    stats = pool_stats(engine)
+    assert stats['pool_class'] == 'TimedQueuePool'
+    assert (stats['size'], stats['checked_in'], stats['checked_out']) == (1, 1, 0)
+    assert (stats['checkouts'], stats['timeouts']) == (2, 1)
+    # the timed out checkout waited for pool_timeout
+    assert stats['wait_max_ms'] >= 40
+    assert stats['wait_avg_ms'] == pytest.approx(stats['wait_total_ms'] / 2, abs=0.01)
+
+
+def test_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT', '5000')
+    monkeypatch.setenv('DB_POOL_PRE_PING', '0')
+    options = engine_options_from_env('postgresql://localhost/app')
+    assert options['poolclass'] is TimedQueuePool
+    assert (options['pool_size'], options['max_overflow']) == (3, 10)
+    assert options['pool_pre_ping'] is False
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+    # sqlite pools take no size, only pre-ping is passed
+    assert engine_options_from_env('sqlite:///x.db') == {'pool_pre_ping': False}
+
+
+def test_pool_endpoint(client, monkeypatch):
+    response = client.get('/internal/pool')
+    assert response.status_code == 200
+    assert response.json['pid'] == os.getpid()
+    assert len(response.json['replicas']) == 1
+    monkeypatch.setenv('INTERNAL_API_TOKEN', 'token')
+    assert client.get('/internal/pool').status_code == 403
+    assert client.get('/internal/pool', headers={'X-Internal-Token': 'token'}).status_code == 200
@@ -0,0 +1,51 @@
+import shutil
+import pytest
+from sqlalchemy import create_engine
+from tests.conftest import DB_PATH
+from replicas import replicas
+
+
+@pytest.fixture
+def lagging_replica(app, catalog, tmp_path, monkeypatch):
+    """A replica frozen at the catalog fixture, it never sees later writes."""
+    path = str(tmp_path / 'replica.db')
+    shutil.copyfile(DB_PATH, path)
+    engine = create_engine('sqlite:///' + path)
+    monkeypatch.setattr(replicas, 'engines', [engine])
+    yield engine
+    engine.dispose()
+
+
+def test_writer_reads_its_write_through_the_cache(app, lagging_replica):
+    writer, reader = app.test_client(), app.test_client()
+    assert writer.patch('/update/planet/1', json={"climate": "frozen"}).status_code == 200
+
+    # another client is routed to the replica and gets the old row, as replication lag allows
+    response = reader.get('/planets/1')
+    assert response.json['climate'] == 'arid'
+    assert response.headers['X-Cache'] == 'BYPASS'
+
+    # the writer is sticky to the primary and must not get the replica's body from the cache
+    response = writer.get('/planets/1')
+    assert response.json['climate'] == 'frozen'
+    assert writer.get('/planets/1').headers['X-Cache'] == 'HIT'
+    assert reader.get('/planets').json[0]['climate'] == 'arid'
+    assert writer.get('/planets').json[0]['climate'] == 'frozen'
+
+
+def test_favorites_index_is_loaded_from_the_primary(app, lagging_replica, monkeypatch):
+    # no per-user sticky window (another worker's local store), only the writer's cookie
+    monkeypatch.setattr(replicas, 'store', None)
+    writer, reader = app.test_client(), app.test_client()
+    assert writer.post('/favorite/planet/2?user_id=1').status_code == 200
+    assert reader.get('/users/1/favorites/contains?planet_ids=1,2').json == {"planet_ids": [2]}
+    assert writer.get('/users/1/favorites/contains?planet_ids=1,2').json == {"planet_ids": [2]}
+
+
+def test_replica_reads_still_answer_304(client, catalog):
+    response = client.get('/planets/1')
+    assert response.headers['X-Cache'] == 'BYPASS'
+    response = client.get('/planets/1', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    response = client.get('/planets')
+    assert client.get('/planets', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
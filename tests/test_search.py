@@ -0,0 +1,82 @@
+import pytest
+from models import db, People, Planets, Vehicles
+from utils import encode_cursor
+
+
+@pytest.fixture
+def names(app):
+    with app.app_context():
+        db.session.add_all([
+            People(id=1, name='Luke Skywalker'),
+            People(id=2, name='Anakin Skywalker'),
+            People(id=3, name='Leia Organa'),
+            Planets(id=1, name='Skyrim'),
+            Vehicles(id=1, name='skyhopper'),
+            Vehicles(id=2, name='Sand Crawler'),
+        ])
+        db.session.commit()
+
+
+def search(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.json
+    return [(row['kind'], row['id']) for row in response.json], response.headers.get('X-Next-Cursor')
+
+
+def test_prefix_matches_come_first_then_substring_matches(client, names):
+    results, cursor = search(client, '/search?q=SKY')
+    # prefixes alphabetically whatever the case, then the rest by id
+    assert results == [('vehicle', 1), ('planet', 1), ('people', 1), ('people', 2)]
+    assert cursor is None
+
+
+def test_short_queries_only_match_prefixes(client, names):
+    results, _ = search(client, '/search?q=sk')
+    assert results == [('vehicle', 1), ('planet', 1)]
+
+
+def test_pages_cross_the_tier_boundary(client, names):
+    seen, url = [], '/search?q=sky&limit=1'
+    pages = 0
+    while url:
+        results, cursor = search(client, url)
+        seen += results
+        pages += 1
+        url = '/search?q=sky&limit=1&after=%s' % cursor if cursor else None
+    assert seen == [('vehicle', 1), ('planet', 1), ('people', 1), ('people', 2)]
+    assert pages == 4
+
+    first, cursor = search(client, '/search?q=sky&limit=3')
+    rest, cursor = search(client, '/search?q=sky&limit=3&after=%s' % cursor)
+    assert first + rest == seen and cursor is None
+
+
+def test_the_search_tables_follow_renames_and_deletes(client, app, names):
+    assert client.put('/update/people/3', json={"name": "Leia Skywalker"}).status_code == 200
+    assert client.patch('/update/people/1', json={"name": "Luke"}).status_code == 200
+    client.delete('/delete/vehicle/1')
+    results, _ = search(client, '/search?q=walker')
+    assert results == [('people', 2), ('people', 3)]
+    results, _ = search(client, '/search?q=Luke')
+    assert results == [('people', 1)]
+    assert search(client, '/search?q=hopper')[0] == []
+
+
+@pytest.mark.parametrize('values', [
+    [0, None, 0, 0],
+    [0, 7, 0, 0],
+    [1, 'sky', 0, 0],
+    [2, None, 0, 0],
+    [1, None, 'people', 0],
+    [0, 'sky', 0, 1.5],
+    [0, 'sky', 0],
+])
+def test_bad_cursors(client, names, values):
+    assert client.get('/search?q=sky&after=%s' % encode_cursor(values)).status_code == 400
+
+
+def test_garbage_cursor_and_parameters(client, names):
+    assert client.get('/search?q=sky&after=WzAsIG51bGwsIDAsIDBd').status_code == 400
+    assert client.get('/search?q=sky&after=%%%').status_code == 400
+    assert client.get('/search').status_code == 400
+    assert client.get('/search?q=sky&limit=0').status_code == 400
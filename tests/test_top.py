@@ -0,0 +1,79 @@
+from sqlalchemy import delete, select, literal
+from sqlalchemy.dialects import postgresql
+from models import db, Favorites, People, Planets, Vehicles
+
+
+def add(client, kind, entity_id, user_id=1):
+    return client.post('/favorite/%s/%d?user_id=%d' % (kind, entity_id, user_id))
+
+
+def counts(app, model):
+    with app.app_context():
+        return dict(db.session.execute(select(model.id, model.favorites_count).order_by(model.id)).all())
+
+
+def test_counters_follow_the_writes(client, app, catalog):
+    add(client, 'planet', 1)
+    add(client, 'planet', 1, user_id=2)
+    add(client, 'planet', 1)  # already a favorite, not counted twice
+    add(client, 'planet', 2)
+    client.delete('/favorite/planet/1?user_id=2')
+    client.delete('/favorite/planet/3?user_id=2')  # not a favorite
+    assert counts(app, Planets) == {1: 1, 2: 1, 3: 0}
+
+
+def test_batch_writes_keep_the_counters(client, app, catalog):
+    client.post('/users/1/favorites:batch', json=[{"kind": "vehicle", "id": i} for i in (1, 2, 2, 3)])
+    client.post('/users/2/favorites:batch', json=[{"kind": "vehicle", "id": 2}, {"kind": "people", "id": 1}])
+    assert counts(app, Vehicles) == {1: 1, 2: 2, 3: 1}
+    client.delete('/users/1/favorites:batch', json=[{"kind": "vehicle", "id": i} for i in (2, 3)])
+    assert counts(app, Vehicles) == {1: 1, 2: 1, 3: 0}
+    assert counts(app, People) == {1: 1, 2: 0, 3: 0}
+
+
+def test_deleted_users_favorites_leave_the_other_counters(client, app, catalog):
+    add(client, 'people', 1)
+    add(client, 'planet', 1)
+    client.delete('/delete/people/1')
+    assert counts(app, Planets)[1] == 1
+    assert client.get('/planets/top').json[0]['favorites_count'] == 1
+
+
+def test_top_lists_order_by_count_then_newest(client, catalog):
+    add(client, 'planet', 1)
+    add(client, 'planet', 2)
+    add(client, 'planet', 2, user_id=2)
+    add(client, 'planet', 3)
+    response = client.get('/planets/top')
+    assert response.status_code == 200
+    assert [(row['id'], row['favorites_count']) for row in response.json] == [(2, 2), (3, 1), (1, 1)]
+    assert response.json[0]['name'] == 'Planet 2'
+    assert [row['id'] for row in client.get('/planets/top?limit=1').json] == [2]
+    # rows nobody picked are left out
+    assert client.get('/vehicles/top').json == []
+    assert client.get('/people/top?limit=0').status_code == 400
+    assert client.get('/people/top?limit=x').status_code == 400
+
+
+def test_top_lists_follow_deletes(client, catalog):
+    add(client, 'vehicle', 1)
+    add(client, 'vehicle', 2)
+    add(client, 'vehicle', 2, user_id=2)
+    client.delete('/favorite/vehicle/2?user_id=1')
+    client.delete('/favorite/vehicle/2?user_id=2')
+    assert [row['id'] for row in client.get('/vehicles/top').json] == [1]
+
+
+def test_postgres_writes_the_favorite_and_its_counter_in_one_statement(app):
+    insert = postgresql.insert(Favorites).on_conflict_do_nothing().from_select(
+        ['user_id', 'entity_type', 'entity_id'],
+        select(literal(1), literal('planet'), Planets.id).where(Planets.id == 2))
+    sql = str(Favorites._counted_statement('planet', insert, 1).compile(dialect=postgresql.dialect()))
+    assert sql.startswith('WITH changed AS \n(INSERT INTO favorites')
+    assert 'RETURNING favorites.entity_id)\n UPDATE planets SET favorites_count=' in sql
+    assert 'WHERE planets.id IN (SELECT changed.entity_id \nFROM changed) RETURNING planets.id' in sql
+
+    remove = delete(Favorites).where(Favorites.user_id == 1, Favorites.entity_type == 'people')
+    sql = str(Favorites._counted_statement('people', remove, -1).compile(dialect=postgresql.dialect()))
+    assert sql.startswith('WITH changed AS \n(DELETE FROM favorites')
+    assert 'UPDATE people SET favorites_count=(people.favorites_count + ' in sql